@@ -0,0 +1,12 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import HTTPException
+
+def require_admin(token: Optional[str]):
+    """Reject admin requests unless they carry the ADMIN_TOKEN from the environment"""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.")
+    if not token or not secrets.compare_digest(token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
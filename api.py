@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from metrics import observe_request, timing_header
+from startup import BackgroundLoader, NotReady
+from streaming import STREAM_HEADERS, STREAM_MEDIA_TYPES, stream_answer_events, stream_format
+from workers import Overloaded, WorkerPool
+
+# Request handling shared by main.py and main_lightweight.py
+
+class QueryRequest(BaseModel):
+    question: str
+    image: Optional[str] = None  # base64 encoded image
+    stream: bool = False  # Stream the links, then the answer, as JSON lines or Server-Sent Events
+
+class QueryResponse(BaseModel):
+    answer: str
+    links: List[Dict[str, str]]
+
+class BatchRequest(BaseModel):
+    questions: List[QueryRequest]
+
+class BatchResult(BaseModel):
+    answer: Optional[str] = None
+    links: List[Dict[str, str]] = []
+    error: Optional[str] = None  # Set instead of answer when this question could not be answered
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+
+# Per-request deadline, replaces the old after-the-fact 30 second warning
+REQUEST_TIMEOUT = float(os.environ.get("TA_REQUEST_TIMEOUT", 30))
+
+# Send X-Timing on every response, not only when the request asks for it
+TIMING_HEADER = os.environ.get("TA_TIMING_HEADER") == "1"
+
+# Limits of /api/batch: questions per request, and the deadline of the whole batch
+API_BATCH_MAX = int(os.environ.get("TA_API_BATCH_MAX", 500))
+API_BATCH_TIMEOUT = float(os.environ.get("TA_API_BATCH_TIMEOUT", 300))
+
+class ApiCall:
+    """Outcome and stage timings of one request, recorded in the metrics when it ends"""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.outcome = "error"
+        self.timings: Optional[Dict[str, float]] = None
+
+    def add_timing(self, headers: MutableMapping[str, str], x_timing: Optional[str]):
+        """Set X-Timing in the response headers when the request asked for it (or TA_TIMING_HEADER is set)"""
+        if x_timing is not None or TIMING_HEADER:
+            headers["X-Timing"] = timing_header(self.timings, time.perf_counter() - self.start_time)
+
+@contextmanager
+def api_call(route: str, deadline: float, work: str = "Request") -> Iterator[ApiCall]:
+    """
+    Map the errors of a request to status codes and record its outcome
+
+    Bad requests keep their status code, a saturated worker pool or an index that is still
+    loading answers 503 with Retry-After, a missed deadline 504 and anything else 500.
+    """
+    call = ApiCall()
+    try:
+        yield call
+    except HTTPException:
+        call.outcome = "bad_request"
+        raise
+    except (Overloaded, NotReady) as e:
+        call.outcome = "overloaded" if isinstance(e, Overloaded) else "not_ready"
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        call.outcome = "timeout"
+        print(f"Warning: {work} exceeded the {deadline:.0f} second deadline")
+        raise HTTPException(status_code=504, detail=f"{work} exceeded the {deadline:.0f} second deadline")
+    except Exception as e:
+        print(f"Error processing {work.lower()}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        observe_request(route, call.outcome, time.perf_counter() - call.start_time, call.timings)
+
+async def stream_question(call: ApiCall, request: QueryRequest, accept: Optional[str], x_timing: Optional[str],
+                          worker_pool: WorkerPool, stream_answer: Callable) -> StreamingResponse:
+    """
+    Start a streamed answer: the links as soon as retrieval is done, then the answer pieces
+
+    stream_answer(question, image) returns ((links, timings), pieces) and runs on a worker,
+    which keeps its slot until the last piece.
+    """
+    (links, call.timings), pieces = await worker_pool.stream(
+        stream_answer, request.question.strip(), request.image, timeout=REQUEST_TIMEOUT
+    )
+    call.outcome = "ok"
+    output = stream_format(accept)
+    headers = dict(STREAM_HEADERS)
+    call.add_timing(headers, x_timing)
+    return StreamingResponse(stream_answer_events(output, links, pieces),
+                             media_type=STREAM_MEDIA_TYPES[output], headers=headers)
+
+def answer_items(virtual_ta: Any, items: List[Tuple[str, Optional[str]]]) -> List[Dict]:
+    """Answer (question, image) pairs in order: questions without images in one engine batch, the rest one by one"""
+    results: List[Optional[Dict]] = [None] * len(items)
+    batched_rows = []
+    for i, (question, image) in enumerate(items):
+        if not question:
+            results[i] = {"error": "Question cannot be empty"}
+        elif image:
+            answer, links = virtual_ta.answer_question(question=question, image_base64=image)
+            results[i] = {"answer": answer, "links": links}
+        else:
+            batched_rows.append(i)
+    answers = virtual_ta.answer_questions([items[i][0] for i in batched_rows])
+    for i, (answer, links) in zip(batched_rows, answers):
+        results[i] = {"answer": answer, "links": links}
+    return results
+
+async def answer_batch_request(request: BatchRequest, response: Response, x_timing: Optional[str],
+                               loader: BackgroundLoader, worker_pool: WorkerPool,
+                               answer_batch: Callable) -> BatchResponse:
+    """
+    Body of POST /api/batch
+
+    answer_batch(items) returns (results, timings) for a list of (question, image) pairs.
+    """
+    with api_call("/api/batch", API_BATCH_TIMEOUT, "Batch") as call:
+        if not request.questions:
+            raise HTTPException(status_code=400, detail="Questions cannot be empty")
+        if len(request.questions) > API_BATCH_MAX:
+            raise HTTPException(status_code=413, detail=f"At most {API_BATCH_MAX} questions per batch")
+        # Fail fast while the index is still loading
+        loader.get()
+
+        # The whole batch takes one worker, so it cannot crowd out interactive questions
+        items = [(item.question.strip(), item.image) for item in request.questions]
+        results, call.timings = await worker_pool.run(answer_batch, items, timeout=API_BATCH_TIMEOUT)
+
+        call.outcome = "ok"
+        call.add_timing(response.headers, x_timing)
+        return BatchResponse(results=[BatchResult(**result) for result in results])
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class QueryBatcher:
+    """
+    Collects questions that arrive within a short window and answers them with one batch call
+
+    The batch function runs in an executor so encoding never blocks the event loop,
+    and each awaiting request gets its own result back.
+    """
+
+    def __init__(self, answer_batch: Callable[[List[str]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, executor: Optional[Executor] = None):
+        self.answer_batch = answer_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.batches = 0
+        self.batched_questions = 0
+        self._pending: List[Tuple[str, asyncio.Future, Optional[Callable[[], None]]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def enqueue(self, question: str, on_done: Optional[Callable[[], None]] = None) -> asyncio.Future:
+        """
+        Queue a question for the next batch and return the future of its answer
+
+        on_done is called once the batch holding the question has finished, even when the
+        future was cancelled because its caller stopped waiting.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((question, future, on_done))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return future
+
+    async def submit(self, question: str) -> Any:
+        """Queue a question for the next batch and wait for its answer"""
+        return await self.enqueue(question)
+
+    def _flush(self):
+        """Hand the pending questions to a worker as one batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, Optional[Callable[[], None]]]]):
+        loop = asyncio.get_running_loop()
+        questions = [question for question, _, _ in batch]
+        self.batches += 1
+        self.batched_questions += len(questions)
+
+        try:
+            results = await loop.run_in_executor(self.executor, self.answer_batch, questions)
+        except Exception as e:
+            logger.error(f"Error answering batch of {len(questions)} questions: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for _, _, on_done in batch:
+                if on_done is not None:
+                    on_done()
+
+        for (_, future, _), result in zip(batch, results):
+            # The request may have been cancelled (client disconnect or deadline) while the batch ran
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        """Batch counters for monitoring"""
+        return {
+            "batches": self.batches,
+            "questions": self.batched_questions,
+            "avg_batch_size": round(self.batched_questions / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the TDS Virtual TA API.
+Measures the import time of the server modules and their heavy dependencies in fresh
+interpreters, and how long a server takes to answer /health (listening) and /ready (searchable).
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+MODULES = ["numpy", "faiss", "sentence_transformers", "fastapi", "utils_lightweight", "main_lightweight", "utils", "main"]
+
+def import_time(module: str) -> float:
+    """Seconds to import module in a fresh interpreter"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    return float(result.stdout.strip().splitlines()[-1])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(url: str, deadline: float) -> float:
+    """Poll url until it answers 200, returns the time it did"""
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.time()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} did not answer within the timeout")
+
+def server_startup(app: str, timeout: float) -> tuple:
+    """Start uvicorn with app, returns seconds until /health and /ready answer 200"""
+    port = free_port()
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/health", start + timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", start + timeout)
+        return live - start, ready - start
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and time-to-listening of the API")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per measurement (median is reported)")
+    parser.add_argument("--modules", nargs="*", default=MODULES, help="Modules to time the import of")
+    parser.add_argument("--apps", nargs="*", default=["main_lightweight:app", "main:app"],
+                        help="uvicorn apps to time the startup of")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for a server to become ready")
+    args = parser.parse_args()
+
+    # Run from the project directory so the server modules and data files are found
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    print(f"⏱️  Import time (median of {args.runs} fresh interpreters)")
+    for module in args.modules:
+        try:
+            times = [import_time(module) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"   {module:<24} skipped: {e}")
+            continue
+        print(f"   {module:<24} {statistics.median(times) * 1000:8.1f} ms")
+
+    print(f"\n⏱️  Server startup (median of {args.runs} runs)")
+    for app in args.apps:
+        try:
+            runs = [server_startup(app, args.timeout) for _ in range(args.runs)]
+        except TimeoutError as e:
+            print(f"   {app:<24} failed: {e}")
+            continue
+        live = statistics.median(run[0] for run in runs)
+        ready = statistics.median(run[1] for run in runs)
+        print(f"   {app:<24} /health after {live:.2f}s, /ready after {ready:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark for the TDS Virtual TA.
+Runs TDSVirtualTA and LightweightTDSVirtualTA in-process (each in its own interpreter, so
+peak memory and build time are per engine) or a running server over HTTP, against a fixed
+query set, and reports latency percentiles, throughput at several concurrency levels,
+peak RSS, index build time and retrieval quality.
+
+Retrieval quality uses discourse topic titles as queries: titles are not part of the indexed
+post text, and a result counts as relevant when it links to a post of the same topic.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from corpus import iter_posts
+
+ENGINES = ("lightweight", "full")
+CONCURRENCY_LEVELS = [1, 4, 16]
+TOP_K = 5
+
+# Hand-written questions, timed but not scored
+SAMPLE_QUESTIONS = [
+    "What is PromptFoo and how do I use it?",
+    "Should I use gpt-4o-mini which AI proxy supports, or gpt3.5 turbo?",
+    "How do I evaluate my application with promptfoo?",
+    "What are the memory requirements for this project?",
+]
+
+Query = Tuple[str, Optional[str]]  # (question, topic url of the relevant posts, or None)
+
+def load_queries(num_queries: int, seed: int = 0) -> List[Query]:
+    """A fixed sample of discourse topic titles with their topic url, plus the sample questions"""
+    topics: Dict[str, str] = {}
+    for post in iter_posts():
+        if isinstance(post, dict) and post.get('topic_title') and post.get('url'):
+            # Post urls end in the post number (or a bare slash), the topic url is what precedes it
+            topics.setdefault(post['topic_title'], post['url'].rsplit('/', 1)[0])
+    titles = sorted(topics)
+    random.Random(seed).shuffle(titles)
+    return [(title, topics[title]) for title in titles[:num_queries]] + [(q, None) for q in SAMPLE_QUESTIONS]
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in [0, 100]"""
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+def score(results: List[List[str]], queries: List[Query], k: int = TOP_K) -> Dict[str, float]:
+    """recall@k and MRR@k of ranked result urls against each query's topic url"""
+    hits, reciprocal_ranks, scored = 0, 0.0, 0
+    for urls, (_, topic_url) in zip(results, queries):
+        if topic_url is None:
+            continue
+        scored += 1
+        for rank, url in enumerate(urls[:k], 1):
+            if url.startswith(topic_url + '/'):
+                hits += 1
+                reciprocal_ranks += 1 / rank
+                break
+    return {
+        f"recall@{k}": round(hits / scored, 4) if scored else 0.0,
+        "mrr": round(reciprocal_ranks / scored, 4) if scored else 0.0,
+        "scored_queries": scored,
+    }
+
+def run_queries(ask: Callable[[str], List[str]], queries: List[Query], concurrency_levels: List[int],
+                rounds: int) -> Dict[str, Any]:
+    """Time every query sequentially, then measure throughput at each concurrency level"""
+    # The first pass is scored and gives the single-client latency distribution
+    results, latencies = [], []
+    for question, _ in queries:
+        start = time.perf_counter()
+        results.append(ask(question))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    report = {
+        "queries": len(queries),
+        **score(results, queries),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2),
+        },
+        "throughput": [],
+    }
+
+    workload = [question for question, _ in queries] * rounds
+    for concurrency in concurrency_levels:
+        request_latencies = []
+        def timed(question: str):
+            start = time.perf_counter()
+            ask(question)
+            request_latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, workload))
+        elapsed = time.perf_counter() - start
+        report["throughput"].append({
+            "concurrency": concurrency,
+            "qps": round(len(workload) / elapsed, 1),
+            "p50_ms": round(percentile(request_latencies, 50), 2),
+            "p99_ms": round(percentile(request_latencies, 99), 2),
+        })
+    return report
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def create_engine(engine: str, index_dir: Optional[str]):
+    """Build or load an engine with answer and embedding caches off, so every query searches"""
+    if engine == "lightweight":
+        from utils_lightweight import LightweightTDSVirtualTA
+        return LightweightTDSVirtualTA(answer_cache_size=0, use_stemming=os.environ.get("TA_STEMMING") == "1")
+    from utils import TDSVirtualTA
+    virtual_ta = TDSVirtualTA(
+        index_dir=index_dir,
+        index_type=os.environ.get("TA_INDEX_TYPE", "flat"),
+        retrieval=os.environ.get("TA_RETRIEVAL", "hybrid"),
+        fusion=os.environ.get("TA_FUSION", "rrf"),
+        use_stemming=os.environ.get("TA_STEMMING") == "1",
+        encoder=os.environ.get("TA_ENCODER", "torch"),
+        answer_cache_size=0,
+        embedding_cache_size=0,
+    )
+    virtual_ta.model  # Count the encoder load as part of the build
+    return virtual_ta
+
+def bench_engine(engine: str, queries: List[Query], args) -> Dict[str, Any]:
+    """In-process benchmark of one engine, meant to run in a fresh interpreter"""
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    virtual_ta = create_engine(engine, args.index_dir)
+    build_seconds = time.perf_counter() - start
+
+    def ask(question: str) -> List[str]:
+        _, links = virtual_ta.answer_question(question)
+        return [link["url"] for link in links]
+
+    report = run_queries(ask, queries, args.concurrency, args.rounds)
+    return {
+        "engine": engine,
+        "build_seconds": round(build_seconds, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+        **report,
+    }
+
+def bench_engine_subprocess(engine: str, args) -> Dict[str, Any]:
+    """Run bench_engine in a child interpreter so engines do not share peak memory or warm imports"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    command = [sys.executable, os.path.abspath(__file__), "--child", engine, "--result-file", result_file,
+               "--queries", str(args.queries), "--seed", str(args.seed), "--rounds", str(args.rounds),
+               "--concurrency", *map(str, args.concurrency)]
+    if args.index_dir:
+        command += ["--index-dir", args.index_dir]
+    try:
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL if args.quiet else None)
+        if completed.returncode != 0:
+            raise RuntimeError(f"exited with status {completed.returncode}")
+        with open(result_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.unlink(result_file)
+
+def bench_http(url: str, queries: List[Query], args) -> Dict[str, Any]:
+    """Benchmark a running server through POST /api/, sampling its memory from /health"""
+    import requests
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(args.concurrency)))
+    base_url = url.rstrip("/")
+
+    def ask(question: str) -> List[str]:
+        response = session.post(f"{base_url}/api/", json={"question": question}, timeout=args.timeout)
+        response.raise_for_status()
+        return [link["url"] for link in response.json()["links"]]
+
+    def server_memory() -> Optional[float]:
+        try:
+            return session.get(f"{base_url}/health", timeout=5).json().get("memory_usage_mb")
+        except (requests.RequestException, ValueError):
+            return None
+
+    # /health reports current RSS only, so sample it while the queries run and keep the maximum
+    samples: List[float] = []
+    done = threading.Event()
+    def sample_memory():
+        while not done.is_set():
+            memory = server_memory()
+            if memory is not None:
+                samples.append(memory)
+            done.wait(0.5)
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    try:
+        report = run_queries(ask, queries, args.concurrency, args.rounds)
+    finally:
+        done.set()
+        sampler.join()
+    return {
+        "engine": base_url,
+        "build_seconds": None,
+        "peak_rss_mb": max(samples) if samples else None,
+        **report,
+    }
+
+def print_report(report: Dict[str, Any]):
+    latency = report["latency_ms"]
+    print(f"\n📊 {report['engine']}")
+    if report.get("build_seconds") is not None:
+        print(f"   Build/load time: {report['build_seconds']:.2f}s")
+    if report.get("peak_rss_mb") is not None:
+        print(f"   Peak RSS:        {report['peak_rss_mb']:.1f} MB")
+    print(f"   recall@{TOP_K}: {report[f'recall@{TOP_K}']:.3f}   MRR: {report['mrr']:.3f}   "
+          f"({report['scored_queries']} topic-title queries)")
+    print(f"   Latency ({report['queries']} queries, 1 client): p50 {latency['p50']:.1f} ms, "
+          f"p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms")
+    for level in report["throughput"]:
+        print(f"   Concurrency {level['concurrency']:>3}: {level['qps']:8.1f} QPS   "
+              f"p50 {level['p50_ms']:.1f} ms, p99 {level['p99_ms']:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput, memory and recall")
+    parser.add_argument("--engines", nargs="*", choices=ENGINES, default=list(ENGINES),
+                        help="Engines to benchmark in-process")
+    parser.add_argument("--url", help="Benchmark a running server (e.g. http://localhost:8000) instead")
+    parser.add_argument("--index-dir", default=None,
+                        help="Prebuilt index for the full engine (default: build from scratch, timing the build)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of topic-title queries")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the topic-title sample")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=CONCURRENCY_LEVELS,
+                        help="Concurrency levels for the throughput runs")
+    parser.add_argument("--rounds", type=int, default=1, help="Passes over the query set per concurrency level")
+    parser.add_argument("--timeout", type=float, default=60, help="HTTP request timeout in seconds")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--quiet", action="store_true", help="Hide the engines' own output")
+    parser.add_argument("--child", choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Run from the project directory so the data files are found
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    queries = load_queries(args.queries, args.seed)
+
+    if args.child:
+        report = bench_engine(args.child, queries, args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        return
+
+    reports = []
+    if args.url:
+        print(f"🌐 Benchmarking {args.url} with {len(queries)} queries")
+        reports.append(bench_http(args.url, queries, args))
+    else:
+        for engine in args.engines:
+            print(f"⚙️  Benchmarking {engine} engine with {len(queries)} queries")
+            try:
+                reports.append(bench_engine_subprocess(engine, args))
+            except RuntimeError as e:
+                print(f"   {engine} engine failed: {e}")
+
+    for report in reports:
+        print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
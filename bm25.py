@@ -0,0 +1,106 @@
+import math
+import heapq
+import itertools
+from array import array
+from operator import itemgetter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+class BM25Index:
+    """
+    Inverted index scored with Okapi BM25, over integer term ids from tokenizer.Tokenizer
+
+    While documents are added, each (term, document, frequency) posting is appended to three
+    flat arrays. finalize() groups them by term with a counting sort into CSR form: one offsets
+    array indexed by term id into one document id array and one frequency array, with IDF in
+    an array alongside, so the index is a handful of flat arrays and queries only touch the
+    slices of their own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = array("I")
+        self.idf = array("d")
+        self._offsets = array("Q", [0])
+        self._doc_ids = array("I")
+        self._term_freqs = array("H")
+        self._length_norm = array("f")
+        # Postings in the order they were added, until finalize()
+        self._pending = (array("I"), array("I"), array("I"))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def num_terms(self) -> int:
+        return len(self._offsets) - 1
+
+    def add(self, term_ids: Sequence[int]) -> int:
+        """Index a document given as term ids and return its id, all documents come before finalize()"""
+        doc_id = len(self.doc_lengths)
+        term_counts: Dict[int, int] = {}
+        for term_id in term_ids:
+            term_counts[term_id] = term_counts.get(term_id, 0) + 1
+
+        terms, doc_ids, term_freqs = self._pending
+        terms.extend(term_counts.keys())
+        doc_ids.extend(itertools.repeat(doc_id, len(term_counts)))
+        term_freqs.extend(term_counts.values())
+        self.doc_lengths.append(len(term_ids))
+        return doc_id
+
+    def finalize(self):
+        """Group the postings by term and compute IDF and length normalization once all documents are added"""
+        terms, pending_doc_ids, pending_freqs = self._pending
+        num_terms = max(terms, default=-1) + 1
+        document_freqs = [0] * num_terms
+        for term_id in terms:
+            document_freqs[term_id] += 1
+        offsets = array("Q", [0])
+        offsets.extend(itertools.accumulate(document_freqs))
+
+        if max(pending_freqs, default=0) > 0xFFFF:
+            pending_freqs = array("I", (min(tf, 0xFFFF) for tf in pending_freqs))
+
+        # Counting sort: each posting goes to the next free slot of its term, keeping document order
+        positions = offsets.tolist()
+        doc_ids = array("I", bytes(4 * len(terms)))
+        term_freqs = array("H", bytes(2 * len(terms)))
+        for term_id, doc_id, tf in zip(terms, pending_doc_ids, pending_freqs):
+            position = positions[term_id]
+            doc_ids[position] = doc_id
+            term_freqs[position] = tf
+            positions[term_id] = position + 1
+        self._offsets, self._doc_ids, self._term_freqs = offsets, doc_ids, term_freqs
+        self._pending = (array("I"), array("I"), array("I"))
+
+        num_docs = len(self.doc_lengths)
+        avg_length = (sum(self.doc_lengths) / num_docs) if num_docs else 0.0
+        self.idf = array("d", (math.log(1 + (num_docs - df + 0.5) / (df + 0.5)) for df in document_freqs))
+        # k1 * (1 - b + b * |d| / avgdl) per document, the only length-dependent part of the score
+        self._length_norm = array("f", (
+            self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+            for length in self.doc_lengths
+        ))
+
+    def max_score(self, query_ids: Iterable[int]) -> float:
+        """Upper bound of the score of any document for this query"""
+        idf = self.idf
+        return sum(idf[term_id] for term_id in set(query_ids) if term_id < len(idf)) * (self.k1 + 1)
+
+    def search(self, query_ids: Iterable[int], top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return the top_k (doc_id, score) pairs for the query, best first"""
+        scores: Dict[int, float] = {}
+        k1_plus_1 = self.k1 + 1
+        length_norm = self._length_norm
+        offsets = self._offsets
+
+        for term_id in set(query_ids):
+            if term_id >= len(self.idf):
+                continue
+            start, end = offsets[term_id], offsets[term_id + 1]
+            weight = self.idf[term_id] * k1_plus_1
+            for doc_id, tf in zip(self._doc_ids[start:end], self._term_freqs[start:end]):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + length_norm[doc_id])
+
+        return heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Offline build step for the TDS Virtual TA corpus.
+Streams the course pages and discourse posts through the chunker in a process pool and
+writes the chunk table, link tables and per-document row ranges, so that TDSVirtualTA and
+LightweightTDSVirtualTA memory-map them on startup instead of reading and chunking the corpus.
+"""
+
+import os
+import argparse
+import time
+from typing import Tuple
+from corpus_artifact import CORPUS_DIR, artifact_dir, build_corpus
+
+# Chunk size and overlap in tokens of LightweightTDSVirtualTA and TDSVirtualTA
+DEFAULT_CONFIGS = ("64:6", "200:20")
+
+def parse_config(value: str) -> Tuple[int, int]:
+    try:
+        max_tokens, overlap_tokens = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected CHUNK_SIZE:OVERLAP, got {value!r}")
+    return max_tokens, overlap_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk the TDS Virtual TA corpus into a prebuilt artifact")
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR, help="Directory to write the artifact to")
+    parser.add_argument("--configs", nargs="+", type=parse_config, default=[parse_config(c) for c in DEFAULT_CONFIGS],
+                        help="CHUNK_SIZE:OVERLAP pairs to build, one per engine (default: 64:6 200:20)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Chunking processes, 1 chunks in this process (default: all cores)")
+    args = parser.parse_args()
+
+    for max_tokens, overlap_tokens in args.configs:
+        start_time = time.time()
+        manifest = build_corpus(args.corpus_dir, max_tokens, overlap_tokens, workers=args.workers)
+        print(f"✅ {manifest['num_chunks']} chunks of {manifest['num_documents']} documents "
+              f"({max_tokens} tokens, {overlap_tokens} overlap) written to "
+              f"{artifact_dir(args.corpus_dir, max_tokens, overlap_tokens)} in {time.time() - start_time:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Offline build step for the TDS Virtual TA search index.
+Encodes the corpus once and writes the chunk table, embedding matrix and FAISS index
+so that TDSVirtualTA can memory-map them on startup instead of re-encoding.
+"""
+
+import os
+import argparse
+import itertools
+import time
+from corpus import iter_topic_titles
+from utils import TDSVirtualTA, INDEX_DIR
+from encoders import DEFAULT_ENCODER, ENCODER_BACKENDS
+from vector_index import DEFAULT_INDEX_TYPE, INDEX_TYPES, evaluate_recall, index_nbytes
+
+def report_recall(virtual_ta: TDSVirtualTA, num_queries: int, k: int):
+    """Print recall@k of the built index against an exact search, using discourse topic titles as queries"""
+    queries = list(itertools.islice(iter_topic_titles(), num_queries))
+    if not queries:
+        print("⚠️  No discourse topic titles found, skipping the recall evaluation")
+        return
+    result = evaluate_recall(virtual_ta.index, virtual_ta.embeddings, virtual_ta.chunk_ids,
+                             virtual_ta._encode_queries(queries), k=k)
+    flat_bytes = virtual_ta.embeddings.shape[0] * virtual_ta.embeddings.shape[1] * 4
+    print(f"📏 {virtual_ta.index_type} recall@{result['k']} vs exact search: {result['recall']:.3f} "
+          f"over {result['queries']} held-out queries")
+    print(f"   Search: {result['index_ms']:.3f} ms/query (exact {result['exact_ms']:.3f} ms/query)")
+    print(f"   Index size: {index_nbytes(virtual_ta.index) / 1024 / 1024:.2f} MB "
+          f"(float32 vectors {flat_bytes / 1024 / 1024:.2f} MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the TDS Virtual TA search index")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Directory to write the index to")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Maximum chunk size in tokens")
+    parser.add_argument("--overlap", type=int, default=20, help="Tokens repeated between consecutive chunks")
+    parser.add_argument("--index-type", choices=INDEX_TYPES,
+                        default=os.environ.get("TA_INDEX_TYPE", DEFAULT_INDEX_TYPE),
+                        help="FAISS index layout (default: TA_INDEX_TYPE or flat)")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default=os.environ.get("TA_ENCODER", DEFAULT_ENCODER),
+                        help="Embedding backend (default: TA_ENCODER or torch)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the prebuilt index is up to date")
+    parser.add_argument("--eval-recall", action="store_true",
+                        help="Measure recall@k against an exact search on held-out queries")
+    parser.add_argument("--eval-queries", type=int, default=200, help="Number of held-out queries to evaluate")
+    parser.add_argument("--k", type=int, default=5, help="k for recall@k")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    # An existing index is loaded and only changed documents are re-encoded
+    virtual_ta = TDSVirtualTA(
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        index_dir=None if args.force else args.index_dir,
+        index_type=args.index_type,
+        encoder=args.encoder
+    )
+    stats = virtual_ta.last_reindex
+    if virtual_ta.prebuilt_index_dir and not (stats["added_chunks"] or stats["removed_chunks"]):
+        print(f"✅ Index in {args.index_dir} is already up to date ({len(virtual_ta.chunks)} chunks)")
+    else:
+        virtual_ta.save_index(args.index_dir)
+        print(f"✅ {args.index_type} index with {len(virtual_ta.chunks)} chunks written to {args.index_dir} "
+              f"in {time.time() - start_time:.1f}s")
+        print(f"   Changes: {stats}")
+
+    if args.eval_recall:
+        report_recall(virtual_ta, args.eval_queries, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import json
+import mmap
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Marker for a missing url/title in the dictionary-encoded columns
+NO_STRING = 0xFFFFFFFF
+
+MARKDOWN_LINK_PATTERN = re.compile(r'\[([^\]]+)\]\((https?://[^\)]+)\)')
+
+Link = Tuple[str, str]  # (url, text)
+
+@dataclass
+class DocumentChunk:
+    """Represents a chunk of document with metadata"""
+    content: str
+    source: str
+    url: Optional[str] = None
+    title: Optional[str] = None
+    # (url, text) pairs to cite for this chunk, its own url first; filled in by ChunkStore
+    links: Optional[Tuple[Link, ...]] = None
+
+def extract_links(content: str, source: str, url: Optional[str] = None, title: Optional[str] = None) -> List[Link]:
+    """The chunk's own url followed by the markdown links in its text, each url once"""
+    links = []
+    seen_urls = set()
+    if url:
+        links.append((url, title or f"Relevant content from {source}"))
+        seen_urls.add(url)
+    for text, link_url in MARKDOWN_LINK_PATTERN.findall(content):
+        if link_url not in seen_urls:
+            links.append((link_url, text))
+            seen_urls.add(link_url)
+    return links
+
+def _map_file(path: str, typecode: str):
+    """Memory-map a file read-only and view it as an array of typecode"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return array(typecode)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    return view if typecode == "B" else view.cast(typecode)
+
+def _read_file(path: str, typecode: str):
+    """Read a file into an array of typecode (a bytearray for raw bytes)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if typecode == "B":
+        return bytearray(data)
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+def _replace_file(path: str, data: bytes):
+    """Write a file via a temporary path so processes mapping the old file are unaffected"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ChunkStore:
+    """
+    Columnar chunk table
+
+    Chunk text lives in one contiguous UTF-8 buffer addressed by an offset array, and the
+    source/url/title columns are dictionary-encoded into a shared string table, so a url or
+    title repeated across every chunk of a post is stored once. Links are extracted once when
+    a chunk is added: each row points (via a link offset array) at ids in a deduplicated
+    (url, text) link table, so citing a chunk needs no regex at query time. Chunks are only
+    materialized as DocumentChunk objects when they are accessed. A saved store can be
+    memory-mapped, letting several worker processes share one copy through the page cache.
+    """
+
+    def __init__(self):
+        self._text = bytearray()
+        self._offsets = array("Q", [0])
+        self._sources = array("I")
+        self._urls = array("I")
+        self._titles = array("I")
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self._link_offsets = array("Q", [0])
+        self._link_ids = array("I")
+        self._link_urls = array("I")  # String ids of each link's url and text
+        self._link_texts = array("I")
+        self._link_table: Dict[Tuple[int, int], int] = {}
+        self.read_only = False
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def _string(self, string_id: int) -> Optional[str]:
+        return None if string_id == NO_STRING else self._strings[string_id]
+
+    def _intern_link(self, url: str, text: str) -> int:
+        key = (self._intern(url), self._intern(text))
+        link_id = self._link_table.get(key)
+        if link_id is None:
+            link_id = len(self._link_urls)
+            self._link_urls.append(key[0])
+            self._link_texts.append(key[1])
+            self._link_table[key] = link_id
+        return link_id
+
+    def add(self, content: str, source: str, url: Optional[str] = None, title: Optional[str] = None,
+            links: Optional[Iterable[Link]] = None) -> int:
+        """Append a chunk and return its row number, extracting its links unless they are given"""
+        if self.read_only:
+            raise ValueError("Cannot add chunks to a memory-mapped chunk store")
+        self._text += content.encode("utf-8")
+        self._offsets.append(len(self._text))
+        self._sources.append(self._intern(source))
+        self._urls.append(self._intern(url))
+        self._titles.append(self._intern(title))
+
+        if links is None:
+            links = extract_links(content, source, url, title)
+        for link_url, link_text in links:
+            self._link_ids.append(self._intern_link(link_url, link_text))
+        self._link_offsets.append(len(self._link_ids))
+        return len(self._sources) - 1
+
+    def extend(self, chunks: Iterable[DocumentChunk]):
+        """Append DocumentChunk objects"""
+        for chunk in chunks:
+            self.add(chunk.content, chunk.source, chunk.url, chunk.title, chunk.links)
+
+    def select(self, rows: Iterable[int]) -> "ChunkStore":
+        """Return a new in-memory store containing only the given rows, in order"""
+        store = ChunkStore()
+        for row in rows:
+            row = int(row)
+            store.add(self.text(row), self.source(row), self.url(row), self.title(row), self.links(row))
+        return store
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def text(self, row: int) -> str:
+        """Decode the text of one chunk"""
+        return str(self._text[self._offsets[row]:self._offsets[row + 1]], "utf-8")
+
+    def source(self, row: int) -> str:
+        return self._strings[self._sources[row]]
+
+    def url(self, row: int) -> Optional[str]:
+        return self._string(self._urls[row])
+
+    def title(self, row: int) -> Optional[str]:
+        return self._string(self._titles[row])
+
+    def links(self, row: int) -> Tuple[Link, ...]:
+        """(url, text) pairs of one chunk from the link table"""
+        strings = self._strings
+        return tuple(
+            (strings[self._link_urls[link_id]], strings[self._link_texts[link_id]])
+            for link_id in self._link_ids[self._link_offsets[row]:self._link_offsets[row + 1]]
+        )
+
+    @property
+    def num_links(self) -> int:
+        """Number of distinct (url, text) links"""
+        return len(self._link_urls)
+
+    def __getitem__(self, row: int) -> DocumentChunk:
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("chunk row out of range")
+        return DocumentChunk(
+            content=self.text(row),
+            source=self.source(row),
+            url=self.url(row),
+            title=self.title(row),
+            links=self.links(row)
+        )
+
+    def __iter__(self) -> Iterator[DocumentChunk]:
+        for row in range(len(self)):
+            yield self[row]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the columns in bytes"""
+        return (len(self._text) + len(self._offsets) * 8 + len(self) * 12
+                + len(self._link_offsets) * 8 + len(self._link_ids) * 4 + self.num_links * 8
+                + sum(len(value) for value in self._strings))
+
+    def save(self, directory: str, name: str = "chunks"):
+        """
+        Write the store as <name>.bin (text), <name>.offsets, <name>.meta (source/url/title),
+        <name>.link_offsets, <name>.link_ids, <name>.link_table (url and text ids) and <name>.strings.json
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+        _replace_file(base + ".bin", bytes(self._text))
+        _replace_file(base + ".offsets", array("Q", self._offsets).tobytes())
+        _replace_file(base + ".meta", b"".join(
+            array("I", column).tobytes() for column in (self._sources, self._urls, self._titles)
+        ))
+        _replace_file(base + ".link_offsets", array("Q", self._link_offsets).tobytes())
+        _replace_file(base + ".link_ids", array("I", self._link_ids).tobytes())
+        _replace_file(base + ".link_table", b"".join(
+            array("I", column).tobytes() for column in (self._link_urls, self._link_texts)
+        ))
+        header = {"count": len(self), "num_links": self.num_links, "byteorder": sys.byteorder,
+                  "strings": self._strings}
+        _replace_file(base + ".strings.json", json.dumps(header).encode("utf-8"))
+
+    @classmethod
+    def load(cls, directory: str, name: str = "chunks", use_mmap: bool = True) -> "ChunkStore":
+        """Load a saved store, memory-mapping the text and column files unless use_mmap is False"""
+        base = os.path.join(directory, name)
+        with open(base + ".strings.json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Chunk store in {directory} was written with {header['byteorder']} byte order")
+
+        read = _map_file if use_mmap else _read_file
+        store = cls()
+        store._text = read(base + ".bin", "B")
+        store._offsets = read(base + ".offsets", "Q")
+        meta = read(base + ".meta", "I")
+        count = header["count"]
+        if len(store._offsets) != count + 1 or len(meta) != 3 * count:
+            raise ValueError(f"Chunk store in {directory} is inconsistent")
+        store._sources = meta[:count]
+        store._urls = meta[count:2 * count]
+        store._titles = meta[2 * count:]
+
+        num_links = header["num_links"]
+        store._link_offsets = read(base + ".link_offsets", "Q")
+        store._link_ids = read(base + ".link_ids", "I")
+        link_table = read(base + ".link_table", "I")
+        if (len(store._link_offsets) != count + 1 or len(link_table) != 2 * num_links
+                or len(store._link_ids) != store._link_offsets[count]):
+            raise ValueError(f"Chunk store in {directory} has an inconsistent link table")
+        store._link_urls = link_table[:num_links]
+        store._link_texts = link_table[num_links:]
+        store._strings = header["strings"]
+        store._string_ids = {value: i for i, value in enumerate(store._strings)}
+        if not use_mmap:
+            # Only a writable store needs the reverse lookup to deduplicate new links
+            store._link_table = {
+                (url_id, text_id): link_id
+                for link_id, (url_id, text_id) in enumerate(zip(store._link_urls, store._link_texts))
+            }
+        store.read_only = use_mmap
+        return store
@@ -0,0 +1,240 @@
+import re
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import urljoin
+from chunk_store import DocumentChunk
+
+# Model-token estimate that errs high for WordPiece: letters and digits count apart, long
+# words as several pieces and every punctuation mark (underscores too) on its own
+TOKEN_PATTERN = re.compile(r'[^\W\d_]{1,8}|\d{1,3}|[^\w\s]|_')
+FENCE_PATTERN = re.compile(r'^\s*(`{3,}|~{3,})')
+ATX_HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+SETEXT_UNDERLINE_PATTERN = re.compile(r'^(?:=+|-+)\s*$')
+# Headings on the course site link to their own anchor, e.g. [Data Preparation](#/data-preparation?id=...)
+HEADING_LINK_PATTERN = re.compile(r'^\[(.+?)\]\((#[^)\s]*)\)$')
+# Sentence ends are punctuation followed by whitespace, so URLs and version numbers stay whole
+SENTENCE_BREAK_PATTERN = re.compile(r'(?<=[.!?])\s+')
+WORD_BREAK_PATTERN = re.compile(r'\s+')
+# Markdown links and images, never split: the same link syntax as chunk_store.extract_links
+LINK_PATTERN = re.compile(r'!?\[[^\]]+\]\([^\)]+\)')
+
+def count_tokens(text: str) -> int:
+    """Approximate number of model tokens in text, rather more than fewer"""
+    return len(TOKEN_PATTERN.findall(text))
+
+def split_outside_links(text: str, pattern: re.Pattern) -> List[str]:
+    """Split text at the matches of pattern, except where a match falls inside a markdown link"""
+    if "](" not in text:
+        return pattern.split(text)
+    links = [match.span() for match in LINK_PATTERN.finditer(text)]
+    parts, start, i = [], 0, 0
+    for match in pattern.finditer(text):
+        while i < len(links) and links[i][1] <= match.start():
+            i += 1
+        if i < len(links) and links[i][0] < match.end():
+            continue
+        parts.append(text[start:match.start()])
+        start = match.end()
+    parts.append(text[start:])
+    return parts
+
+class MarkdownChunker:
+    """
+    Splits a markdown document into chunks of at most max_tokens tokens
+
+    Chunks never span two sections: every heading starts a new chunk, and each chunk
+    begins with its heading path so it keeps its context. Paragraphs are split at
+    sentence ends only when they do not fit, and never inside a link; fenced code blocks
+    that do not fit are split between lines, each piece fenced again. A chunk cut for size
+    repeats its last paragraph (when shorter than overlap_tokens) at the start of the next
+    one if there is room. The heading path and repeated paragraph count towards max_tokens.
+    Chunks link to their section's anchor when the heading has one, otherwise to the document url.
+    """
+
+    def __init__(self, max_tokens: int = 200, overlap_tokens: int = 20):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _blocks(self, text: str) -> Iterator[Tuple[str, str, int]]:
+        """Yield (kind, text, heading level) for each heading, code block and paragraph"""
+        lines = text.split("\n")
+        paragraph: List[str] = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            fence = FENCE_PATTERN.match(line)
+            if fence:
+                if paragraph:
+                    yield "text", "\n".join(paragraph), 0
+                    paragraph = []
+                marker = fence.group(1)
+                code = [line]
+                i += 1
+                while i < len(lines):
+                    code.append(lines[i])
+                    closing = lines[i].strip()
+                    i += 1
+                    if closing.startswith(marker) and not closing.strip(marker[0]):
+                        break
+                yield "code", "\n".join(code), 0
+                continue
+
+            heading = ATX_HEADING_PATTERN.match(line)
+            if heading:
+                if paragraph:
+                    yield "text", "\n".join(paragraph), 0
+                    paragraph = []
+                yield "heading", heading.group(2), len(heading.group(1))
+            elif SETEXT_UNDERLINE_PATTERN.match(line):
+                # An underline turns the paragraph above into a heading, on its own it is a rule
+                if paragraph:
+                    yield "heading", " ".join(part.strip() for part in paragraph), 1 if line.lstrip()[0] == "=" else 2
+                    paragraph = []
+            elif line.strip():
+                paragraph.append(line)
+            elif paragraph:
+                yield "text", "\n".join(paragraph), 0
+                paragraph = []
+            i += 1
+        if paragraph:
+            yield "text", "\n".join(paragraph), 0
+
+    def _words(self, text: str, budget: int) -> List[Tuple[str, int]]:
+        """(word, tokens) pairs of text, with words longer than budget (e.g. a long URL) cut every budget tokens"""
+        words = []
+        # A link is one word here, so its text and url end up in the same chunk
+        for word in split_outside_links(text, WORD_BREAK_PATTERN):
+            if not word:
+                continue
+            word_tokens = count_tokens(word)
+            if word_tokens <= budget:
+                words.append((word, word_tokens))
+                continue
+            starts = [match.start() for match in TOKEN_PATTERN.finditer(word)][::budget]
+            for piece_start, piece_end in zip(starts, starts[1:] + [len(word)]):
+                piece = word[piece_start:piece_end]
+                words.append((piece, count_tokens(piece)))
+        return words
+
+    def _pack(self, parts: List[Tuple[str, int]], budget: int, separator: str) -> List[Tuple[str, int]]:
+        """Join consecutive (part, tokens) pairs into pieces of at most budget tokens"""
+        pieces, current, tokens = [], [], 0
+        for part, part_tokens in parts:
+            if current and tokens + part_tokens > budget:
+                pieces.append((separator.join(current), tokens))
+                current, tokens = [], 0
+            current.append(part)
+            tokens += part_tokens
+        if current:
+            pieces.append((separator.join(current), tokens))
+        return pieces
+
+    def _split(self, kind: str, text: str, budget: int) -> List[Tuple[str, int]]:
+        """Break a block that does not fit in budget tokens into (piece, tokens) pairs that do"""
+        if kind == "code":
+            # Split long code on line boundaries, each piece fenced again
+            lines = text.split("\n")
+            opening = lines[0]
+            closing = lines[-1] if len(lines) > 1 and FENCE_PATTERN.match(lines[-1]) else FENCE_PATTERN.match(opening).group(1)
+            body = lines[1:-1] if closing == lines[-1] else lines[1:]
+            fence_tokens = count_tokens(opening) + count_tokens(closing)
+            body_budget = max(budget - fence_tokens, 1)
+            parts = []
+            for line in body:
+                line_tokens = count_tokens(line)
+                if line_tokens <= body_budget:
+                    parts.append((line, line_tokens))
+                else:
+                    parts.extend(self._pack(self._words(line, body_budget), body_budget, " "))
+            return [("\n".join([opening, piece, closing]), fence_tokens + tokens)
+                    for piece, tokens in self._pack(parts, body_budget, "\n")]
+
+        parts = []
+        for sentence in split_outside_links(text, SENTENCE_BREAK_PATTERN):
+            sentence_tokens = count_tokens(sentence)
+            if sentence_tokens <= budget:
+                parts.append((sentence, sentence_tokens))
+            else:
+                parts.extend(self._words(sentence, budget))
+        return self._pack(parts, budget, " ")
+
+    def _breadcrumb(self, headings: List[Tuple[int, str, Optional[str]]]) -> str:
+        """Heading path of a section, shortened from the top to at most half of max_tokens"""
+        budget = self.max_tokens // 2
+        names = [heading for _, heading, _ in headings]
+        breadcrumb = " > ".join(names)
+        while len(names) > 1 and count_tokens(breadcrumb) > budget:
+            names.pop(0)
+            breadcrumb = " > ".join(names)
+        if count_tokens(breadcrumb) > budget:
+            breadcrumb = self._pack(self._words(breadcrumb, budget), budget, " ")[0][0]
+        return breadcrumb
+
+    def chunk(self, text: str, source: str, url: Optional[str] = None, title: Optional[str] = None) -> List[DocumentChunk]:
+        """Split a document into chunks carrying its source, url and title"""
+        chunks: List[DocumentChunk] = []
+        headings: List[Tuple[int, str, Optional[str]]] = []  # (level, text, anchor url) of the current section
+        breadcrumb = ""
+        breadcrumb_tokens = 0
+        parts: List[str] = []
+        tokens = 0
+        last_tokens = 0
+        has_body = False
+        last_is_text = False
+
+        def section_url() -> Optional[str]:
+            for _, _, heading_url in reversed(headings):
+                if heading_url:
+                    return heading_url
+            return url
+
+        def start_chunk(carry: Optional[str] = None):
+            nonlocal parts, tokens, has_body
+            parts = [breadcrumb] if breadcrumb else []
+            if carry:
+                parts.append(carry)
+            tokens = sum(count_tokens(part) for part in parts)
+            has_body = False
+
+        def flush():
+            if has_body:
+                chunks.append(DocumentChunk(
+                    content="\n\n".join(parts),
+                    source=source,
+                    url=section_url(),
+                    title=headings[-1][1] if headings else title
+                ))
+
+        start_chunk()
+        for kind, block, level in self._blocks(text):
+            if kind == "heading":
+                flush()
+                heading_url = None
+                link = HEADING_LINK_PATTERN.match(block)
+                if link:
+                    block = link.group(1)
+                    heading_url = urljoin(url, link.group(2)) if url else None
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, block, heading_url))
+                breadcrumb = self._breadcrumb(headings)
+                breadcrumb_tokens = count_tokens(breadcrumb)
+                start_chunk()
+                continue
+
+            # Every piece fits in a new chunk after the heading path
+            budget = self.max_tokens - breadcrumb_tokens
+            block_tokens = count_tokens(block)
+            pieces = [(block, block_tokens)] if block_tokens <= budget else self._split(kind, block, budget)
+            for piece, piece_tokens in pieces:
+                if has_body and tokens + piece_tokens > self.max_tokens:
+                    flush()
+                    carry = (last_is_text and last_tokens <= self.overlap_tokens
+                             and breadcrumb_tokens + last_tokens + piece_tokens <= self.max_tokens)
+                    start_chunk(parts[-1] if carry else None)
+                parts.append(piece)
+                tokens += piece_tokens
+                last_tokens = piece_tokens
+                has_body = True
+                last_is_text = kind == "text"
+        flush()
+        return chunks
@@ -0,0 +1,330 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+COURSE_PAGES_DIR = "tds_pages_md"
+COURSE_FILE = "course.md"
+DISCOURSE_FILE = "discourse.md"
+DISCOURSE_POSTS_FILE = "discourse_posts.json"
+# JSON Lines variant written by scrape_discourse.py, one post per line
+DISCOURSE_POSTS_JSONL_FILE = "discourse_posts.jsonl"
+
+# Separator between pages in course.md, the merged copy of tds_pages_md kept as a fallback
+COURSE_PAGE_SEPARATOR = "\n\n---\n# "
+VIEW_POST_PATTERN = re.compile(r'\[View Post\]\((https?://[^\)]+)\)')
+
+# Text that differs between copies of the same page or post and must not affect deduplication:
+# the page header and YAML front matter of course pages, and the title/author/link lines discourse.md adds
+FRONT_MATTER_PATTERN = re.compile(r'\A(?:# [^\n]*\n+)?---\n(.*?)\n---\n', re.DOTALL)
+FRONT_MATTER_FIELD_PATTERN = re.compile(r'^(\w+):[ \t]*(.*?)[ \t]*$', re.MULTILINE)
+POST_BOILERPLATE_PATTERN = re.compile(r'^(?:### .*|\*\*By .+ on .+\*\*|\[View Post\]\(.*\))$', re.MULTILINE)
+WORD_PATTERN = re.compile(r'\w+')
+
+@dataclass
+class Document:
+    """A single course page or discourse post, the unit of re-indexing"""
+    doc_id: str
+    content: str
+    source: str
+    url: Optional[str] = None
+    title: Optional[str] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of everything that ends up in the document's chunks"""
+        digest = hashlib.sha1()
+        for field in (self.source, self.url or "", self.title or "", self.content):
+            digest.update(field.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+def compute_corpus_hash(fingerprints: Dict[str, str]) -> str:
+    """Hash the per-document fingerprints into a single corpus hash"""
+    digest = hashlib.sha256()
+    for doc_id in sorted(fingerprints):
+        digest.update(f"{doc_id}\0{fingerprints[doc_id]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _read_text(filepath: str) -> str:
+    """Read a text file, returning an empty string if it is missing or unreadable"""
+    if not os.path.exists(filepath):
+        logger.warning(f"File not found: {filepath}")
+        return ""
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return f.read()
+    except Exception as e:
+        logger.error(f"Error reading {filepath}: {e}")
+        return ""
+
+def parse_front_matter(text: str) -> Tuple[Dict[str, str], str]:
+    """Split the YAML front matter (title, original_url, ...) of a course page from its body"""
+    match = FRONT_MATTER_PATTERN.match(text)
+    if not match:
+        return {}, text
+    fields = {}
+    for key, value in FRONT_MATTER_FIELD_PATTERN.findall(match.group(1)):
+        if value.startswith('"'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = value.strip('"')
+        fields[key] = value
+    return fields, text[match.end():].lstrip("\n")
+
+def _course_document(doc_id: str, content: str, default_title: str) -> Document:
+    fields, body = parse_front_matter(content)
+    return Document(doc_id=doc_id, content=body, source="course",
+                    url=fields.get("original_url") or None, title=fields.get("title") or default_title)
+
+def iter_course_documents(pages_dir: str = COURSE_PAGES_DIR, course_file: str = COURSE_FILE) -> Iterator[Document]:
+    """Yield one document per course page, reading tds_pages_md directly when available"""
+    if os.path.isdir(pages_dir):
+        for filename in sorted(os.listdir(pages_dir)):
+            if not filename.endswith(".md"):
+                continue
+            content = _read_text(os.path.join(pages_dir, filename))
+            if content:
+                yield _course_document(f"course:{filename}", content, filename.replace('_', ' ').replace('.md', ''))
+        return
+
+    # Fall back to splitting the merged course.md back into its pages
+    for part in _read_text(course_file).split(COURSE_PAGE_SEPARATOR):
+        if not part.strip():
+            continue
+        page_title = part.split("\n", 1)[0].strip()
+        yield _course_document(f"course:{page_title}", "# " + part, page_title)
+
+def iter_json_array(filepath: str, block_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Incrementally parse a JSON array of objects, yielding one element at a time
+    
+    Only a block of the file plus the element being decoded is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, "r", encoding="utf-8") as f:
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{filepath} does not contain a JSON array")
+        pos = 1
+        while True:
+            # Skip separators, reading more of the file when the buffer runs out
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer):
+                    break
+                more = f.read(block_size)
+                if not more:
+                    raise ValueError(f"Unexpected end of JSON array in {filepath}")
+                buffer, pos = more, 0
+            if buffer[pos] == "]":
+                return
+            
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element continues past the end of the buffer
+                more = f.read(block_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield element
+            pos = end
+            if pos > block_size:
+                buffer, pos = buffer[pos:], 0
+
+def iter_posts(posts_file: str = DISCOURSE_POSTS_FILE, jsonl_file: str = DISCOURSE_POSTS_JSONL_FILE) -> Iterator[Any]:
+    """Stream discourse posts, from the JSON Lines file when it is at least as new as the JSON array"""
+    if os.path.exists(jsonl_file) and (not os.path.exists(posts_file)
+                                       or os.path.getmtime(jsonl_file) >= os.path.getmtime(posts_file)):
+        with open(jsonl_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif os.path.exists(posts_file):
+        yield from iter_json_array(posts_file)
+
+def iter_discourse_documents(discourse_file: str = DISCOURSE_FILE) -> Iterator[Document]:
+    """Yield one document per post block in discourse.md, reading the file line by line"""
+    if not os.path.exists(discourse_file):
+        logger.warning(f"File not found: {discourse_file}")
+        return
+    
+    seen_ids = set()
+    
+    def make_document(i: int, lines) -> Optional[Document]:
+        block = "".join(lines)
+        if not block.strip():
+            return None
+        match = VIEW_POST_PATTERN.search(block)
+        doc_id = f"discourse:{match.group(1) if match else i}"
+        if doc_id in seen_ids:
+            doc_id = f"{doc_id}#{i}"
+        seen_ids.add(doc_id)
+        title = lines[0][4:].strip() if lines[0].startswith("### ") else None
+        return Document(doc_id=doc_id, content=block, source="discourse",
+                        url=match.group(1) if match else None, title=title)
+    
+    block_lines = []
+    block_number = 0
+    with open(discourse_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("### ") and block_lines:
+                doc = make_document(block_number, block_lines)
+                if doc:
+                    yield doc
+                block_lines = []
+                block_number += 1
+            block_lines.append(line)
+    doc = make_document(block_number, block_lines)
+    if doc:
+        yield doc
+
+def iter_discourse_post_documents(posts_file: str = DISCOURSE_POSTS_FILE,
+                                  jsonl_file: str = DISCOURSE_POSTS_JSONL_FILE) -> Iterator[Document]:
+    """Yield one document per discourse post, streaming the posts file"""
+    try:
+        for i, post in enumerate(iter_posts(posts_file, jsonl_file)):
+            if isinstance(post, dict) and 'content' in post:
+                yield Document(
+                    doc_id=f"discourse_post:{post.get('url') or i}",
+                    content=post['content'],
+                    source="discourse_post",
+                    url=post.get('url'),
+                    title=post.get('topic_title') or post.get('title')
+                )
+    except Exception as e:
+        logger.error(f"Error loading discourse posts: {e}")
+
+def iter_topic_titles(posts_file: str = DISCOURSE_POSTS_FILE,
+                      jsonl_file: str = DISCOURSE_POSTS_JSONL_FILE) -> Iterator[str]:
+    """
+    Yield each distinct discourse topic title once
+    
+    Titles are not part of the indexed post text, which makes them a held-out query set
+    for evaluating retrieval.
+    """
+    seen = set()
+    for post in iter_posts(posts_file, jsonl_file):
+        title = post.get('topic_title') if isinstance(post, dict) else None
+        if title and title not in seen:
+            seen.add(title)
+            yield title
+
+def dedup_text(doc: Document) -> str:
+    """Normalized text of a document with per-copy boilerplate removed"""
+    text = FRONT_MATTER_PATTERN.sub('', doc.content, count=1)
+    text = POST_BOILERPLATE_PATTERN.sub('', text)
+    return ' '.join(text.lower().split())
+
+# MinHash value of a bin no shingle hashed into, above any 32-bit hash
+EMPTY_BIN = 1 << 32
+
+class Deduplicator:
+    """
+    Drops exact and near-duplicate documents ahead of chunking
+    
+    Exact duplicates are found by hashing the normalized text. Near duplicates are found with
+    one-permutation MinHash over word 3-shingles: each shingle is hashed once into one of
+    num_bins bins keeping the minimum per bin, and signatures are bucketed by bands of
+    band_size bins (LSH) so only candidate pairs are compared. The first copy seen is kept.
+    Bins that are empty in both signatures are left out of the similarity, otherwise two
+    short documents would look alike just for the bins neither of them filled.
+    """
+    
+    def __init__(self, threshold: float = 0.8, num_bins: int = 64, band_size: int = 8, min_shingles: int = 30):
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.band_size = band_size
+        self.min_shingles = min_shingles
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self._hashes: Set[bytes] = set()
+        self._signatures: List[Tuple[int, ...]] = []
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    
+    def _signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        words = WORD_PATTERN.findall(text)
+        if len(words) - 2 < self.min_shingles:
+            return None  # Too short for MinHash to be reliable, exact matching only
+        
+        num_bins = self.num_bins
+        mins = [EMPTY_BIN] * num_bins
+        for i in range(len(words) - 2):
+            h = zlib.crc32(f"{words[i]} {words[i + 1]} {words[i + 2]}".encode("utf-8"))
+            b = h % num_bins
+            if h < mins[b]:
+                mins[b] = h
+        return tuple(mins)
+    
+    def _similarity(self, a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity over the bins at least one of the two documents filled"""
+        matches = filled = 0
+        for x, y in zip(a, b):
+            if x == EMPTY_BIN and y == EMPTY_BIN:
+                continue
+            filled += 1
+            matches += x == y
+        return matches / filled if filled else 0.0
+    
+    def is_duplicate(self, doc: Document) -> bool:
+        """Check a document against all documents seen so far, remembering it if it is new"""
+        text = dedup_text(doc)
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        if digest in self._hashes:
+            self.exact_duplicates += 1
+            return True
+        self._hashes.add(digest)
+        
+        signature = self._signature(text)
+        if signature is None:
+            return False
+        
+        # A band of empty bins says nothing about the text, it would only pair up short documents
+        bands = [(start, signature[start:start + self.band_size])
+                 for start in range(0, self.num_bins, self.band_size)
+                 if any(value != EMPTY_BIN for value in signature[start:start + self.band_size])]
+        candidates = set()
+        for band in bands:
+            candidates.update(self._buckets.get(band, ()))
+        for candidate in candidates:
+            if self._similarity(signature, self._signatures[candidate]) >= self.threshold:
+                self.near_duplicates += 1
+                return True
+        
+        signature_id = len(self._signatures)
+        self._signatures.append(signature)
+        for band in bands:
+            self._buckets.setdefault(band, []).append(signature_id)
+        return False
+    
+    def filter(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Yield only the documents that are not duplicates of an earlier one"""
+        for doc in docs:
+            if not self.is_duplicate(doc):
+                yield doc
+        logger.info(f"Dropped {self.exact_duplicates} exact and {self.near_duplicates} near-duplicate documents")
+
+def iter_documents(dedupe: bool = True) -> Iterator[Document]:
+    """
+    Yield every document of the corpus: course pages, discourse posts and discourse.md posts
+    
+    discourse.md is written from the same posts as discourse_posts.json, so with dedupe
+    its copies are dropped in favour of the structured posts read before it.
+    """
+    docs = _iter_all_documents()
+    return Deduplicator().filter(docs) if dedupe else docs
+
+def _iter_all_documents() -> Iterator[Document]:
+    yield from iter_course_documents()
+    yield from iter_discourse_post_documents()
+    yield from iter_discourse_documents()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from chunk_store import ChunkStore, DocumentChunk, extract_links
+from chunker import MarkdownChunker
+from corpus import (COURSE_FILE, COURSE_PAGES_DIR, DISCOURSE_FILE, DISCOURSE_POSTS_FILE, DISCOURSE_POSTS_JSONL_FILE,
+                    Document, compute_corpus_hash, iter_documents)
+
+logger = logging.getLogger(__name__)
+
+CORPUS_DIR = "corpus_data"
+CORPUS_FORMAT_VERSION = 4  # Bumped when chunking or deduplication changes, so old artifacts are rebuilt
+SOURCE_PATHS = (COURSE_PAGES_DIR, COURSE_FILE, DISCOURSE_FILE, DISCOURSE_POSTS_FILE, DISCOURSE_POSTS_JSONL_FILE)
+
+def artifact_dir(corpus_dir: str, max_tokens: int, overlap_tokens: int) -> str:
+    """Each chunking configuration gets its own subdirectory, e.g. corpus_data/chunks-64-6"""
+    return os.path.join(corpus_dir, f"chunks-{max_tokens}-{overlap_tokens}")
+
+_worker_chunker: Optional[MarkdownChunker] = None
+
+def _init_worker(max_tokens: int, overlap_tokens: int):
+    global _worker_chunker
+    _worker_chunker = MarkdownChunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+def _chunk_documents(documents: List[Document]) -> List[List[DocumentChunk]]:
+    """Chunk a batch of documents and extract their links, in a worker process"""
+    results = []
+    for doc in documents:
+        chunks = _worker_chunker.chunk(doc.content, doc.source, url=doc.url, title=doc.title)
+        for chunk in chunks:
+            chunk.links = tuple(extract_links(chunk.content, chunk.source, chunk.url, chunk.title))
+        results.append(chunks)
+    return results
+
+def _batches(documents: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_chunked_documents(documents: Iterable[Document], max_tokens: int, overlap_tokens: int,
+                           workers: int = 0, batch_size: int = 16) -> Iterator[Tuple[Document, List[DocumentChunk]]]:
+    """
+    Yield (document, chunks) in document order, chunking in a process pool when workers > 1
+
+    Documents are read lazily and at most 2 * workers batches are in flight, so memory stays
+    bounded by the batches being chunked rather than the corpus.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        _init_worker(max_tokens, overlap_tokens)
+        for batch in _batches(documents, batch_size):
+            yield from zip(batch, _chunk_documents(batch))
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(max_tokens, overlap_tokens)) as executor:
+        pending = deque()
+        for batch in _batches(documents, batch_size):
+            pending.append((batch, executor.submit(_chunk_documents, batch)))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+def build_corpus(corpus_dir: str, max_tokens: int, overlap_tokens: int, workers: int = 0) -> Dict:
+    """
+    Chunk every document and write the chunk store, link tables and per-document row ranges
+
+    Returns the manifest. The manifest is written last and removed first, so a reader never
+    loads a half-written artifact.
+    """
+    directory = artifact_dir(corpus_dir, max_tokens, overlap_tokens)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    store = ChunkStore()
+    documents: Dict[str, Dict] = {}
+    for doc, chunks in iter_chunked_documents(iter_documents(), max_tokens, overlap_tokens, workers):
+        start = len(store)
+        store.extend(chunks)
+        documents[doc.doc_id] = {"fingerprint": doc.fingerprint, "rows": [start, len(store)]}
+
+    store.save(directory)
+    with open(os.path.join(directory, "documents.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(documents, f)
+    os.replace(os.path.join(directory, "documents.json.tmp"), os.path.join(directory, "documents.json"))
+
+    manifest = {
+        "format_version": CORPUS_FORMAT_VERSION,
+        "max_tokens": max_tokens,
+        "overlap_tokens": overlap_tokens,
+        "corpus_hash": compute_corpus_hash({doc_id: info["fingerprint"] for doc_id, info in documents.items()}),
+        "num_documents": len(documents),
+        "num_chunks": len(store),
+        "num_links": store.num_links,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+def newest_source_mtime() -> float:
+    """Modification time of the most recently changed corpus source file (or page directory)"""
+    newest = 0.0
+    for path in SOURCE_PATHS:
+        if not os.path.exists(path):
+            continue
+        newest = max(newest, os.path.getmtime(path))
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                newest = max([newest, *(entry.stat().st_mtime for entry in entries if entry.name.endswith(".md"))])
+    return newest
+
+def load_corpus(corpus_dir: str, max_tokens: int, overlap_tokens: int,
+                use_mmap: bool = True) -> Optional[Tuple[ChunkStore, Dict[str, Dict]]]:
+    """
+    Load the prebuilt chunks for a chunking configuration, with their per-document row ranges
+
+    Returns None when there is no artifact for these settings, or when a source file changed
+    after it was built, so callers fall back to reading and chunking the documents themselves.
+    """
+    directory = artifact_dir(corpus_dir, max_tokens, overlap_tokens)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(manifest_path):
+        logger.info(f"No prebuilt corpus in {directory}")
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != CORPUS_FORMAT_VERSION:
+            logger.warning(f"Prebuilt corpus in {directory} has an old format, run build_corpus.py")
+            return None
+        if newest_source_mtime() > os.path.getmtime(manifest_path):
+            logger.warning(f"Corpus sources changed after {directory} was built, run build_corpus.py")
+            return None
+        chunks = ChunkStore.load(directory, use_mmap=use_mmap)
+        with open(os.path.join(directory, "documents.json"), "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        if len(chunks) != manifest["num_chunks"]:
+            logger.warning(f"Prebuilt corpus in {directory} is inconsistent, run build_corpus.py")
+            return None
+    except Exception as e:
+        logger.error(f"Error loading prebuilt corpus from {directory}: {e}")
+        return None
+
+    logger.info(f"Loaded {len(chunks)} prebuilt chunks of {len(documents)} documents from {directory}")
+    return chunks, documents
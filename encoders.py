@@ -0,0 +1,104 @@
+import os
+import json
+import logging
+import numpy as np
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Embedding backends: sentence-transformers on PyTorch, or the same model exported by export_onnx.py
+ENCODER_BACKENDS = ("torch", "onnx")
+DEFAULT_ENCODER = "torch"
+ONNX_MODEL_DIR = "onnx_model"
+
+class SentenceTransformerEncoder:
+    """The reference encoder, sentence-transformers on PyTorch"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = False, show_progress_bar: bool = False,
+               batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=normalize_embeddings,
+                                 show_progress_bar=show_progress_bar, batch_size=batch_size)
+
+class OnnxEncoder:
+    """
+    Sentence encoder running an exported transformer with onnxruntime on CPU
+
+    Reproduces the sentence-transformers pipeline (tokenize, transformer, mean pooling over
+    the attention mask, L2 normalization) without importing PyTorch. The model directory is
+    written by export_onnx.py and holds the ONNX graph, tokenizer.json and encoder.json.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = True, threads: int = 0):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx encoder needs onnxruntime and tokenizers: pip install onnxruntime tokenizers") from e
+
+        with open(os.path.join(model_dir, "encoder.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        model_file = self.config["quantized_file" if quantized else "model_file"]
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config.get("pad_token_id", 0))
+        logger.info(f"Loaded ONNX encoder {model_file} from {model_dir}")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype='int64')
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype='int64')
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype('float32')
+        return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = False, show_progress_bar: bool = False,
+               batch_size: int = 32) -> np.ndarray:
+        """Encode texts as a (len(texts), dimension) float32 matrix"""
+        embeddings = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype='float32')
+        # Batch texts of similar length together to keep padding small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+            if show_progress_bar:
+                logger.info(f"Encoded {min(start + batch_size, len(texts))}/{len(texts)} texts")
+
+        if normalize_embeddings or self.config.get("normalize", False):
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
+
+def load_encoder(backend: str, model_name: str, onnx_dir: str = ONNX_MODEL_DIR):
+    """Create the encoder for a backend, both expose encode() and get_sentence_embedding_dimension()"""
+    if backend == "torch":
+        return SentenceTransformerEncoder(model_name)
+    if backend == "onnx":
+        encoder = OnnxEncoder(onnx_dir)
+        if encoder.config.get("model_name") != model_name:
+            raise ValueError(f"ONNX model in {onnx_dir} was exported from {encoder.config.get('model_name')}, "
+                             f"not {model_name}")
+        return encoder
+    raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {', '.join(ENCODER_BACKENDS)}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Export the sentence transformer used by TDSVirtualTA to ONNX with dynamic int8 quantization,
+then check that the ONNX encoder reproduces the PyTorch embeddings within a tolerance.
+Needs sentence-transformers (PyTorch), onnx and onnxruntime; serving only needs onnxruntime and tokenizers.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+from corpus import iter_documents, iter_topic_titles
+from encoders import ONNX_MODEL_DIR, OnnxEncoder, SentenceTransformerEncoder
+
+MODEL_NAME = 'all-MiniLM-L6-v2'  # Same model as utils.MODEL_NAME
+
+def export(model_name: str, output_dir: str, opset: int = 17):
+    """Write model.onnx, model_int8.onnx, tokenizer.json and encoder.json to output_dir"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    reference = SentenceTransformerEncoder(model_name).model
+    transformer = reference[0].auto_model.eval()
+    tokenizer = reference.tokenizer
+
+    sample = tokenizer(["An example sentence to trace the graph"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    print(f"📦 Exported {model_name} to {model_path}")
+
+    quantized_path = os.path.join(output_dir, "model_int8.onnx")
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    print(f"📦 Quantized weights to int8: {quantized_path}")
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, "tokenizer.json"))
+    # The reference pipeline ends with a Normalize module for models like all-MiniLM-L6-v2
+    normalize = any(type(module).__name__ == "Normalize" for module in reference)
+    config = {
+        "model_name": model_name,
+        "model_file": "model.onnx",
+        "quantized_file": "model_int8.onnx",
+        "dimension": reference.get_sentence_embedding_dimension(),
+        "max_seq_length": reference.max_seq_length,
+        "pad_token_id": tokenizer.pad_token_id or 0,
+        "normalize": normalize,
+    }
+    with open(os.path.join(output_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    for path in (model_path, quantized_path):
+        print(f"   {os.path.basename(path)}: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+def sample_texts(num_samples: int) -> list:
+    """Corpus passages and discourse topic titles, i.e. what gets encoded in production"""
+    titles = list(itertools.islice(iter_topic_titles(), num_samples // 2))
+    passages = [doc.content[:2000] for doc in itertools.islice(iter_documents(), num_samples - len(titles))]
+    return titles + passages
+
+def check(model_name: str, output_dir: str, num_samples: int, tolerance: float) -> bool:
+    """Compare ONNX embeddings (float32 and int8) to PyTorch ones, True if all are within tolerance"""
+    texts = sample_texts(num_samples)
+    reference = SentenceTransformerEncoder(model_name)
+    start = time.perf_counter()
+    expected = np.asarray(reference.encode(texts, normalize_embeddings=True), dtype='float32')
+    torch_ms = (time.perf_counter() - start) * 1000 / len(texts)
+    print(f"🔍 Checking {len(texts)} texts against PyTorch ({torch_ms:.2f} ms/text)")
+
+    passed = True
+    for quantized in (False, True):
+        encoder = OnnxEncoder(output_dir, quantized=quantized)
+        start = time.perf_counter()
+        actual = encoder.encode(texts, normalize_embeddings=True)
+        onnx_ms = (time.perf_counter() - start) * 1000 / len(texts)
+        cosine = np.sum(expected * actual, axis=1)
+        # Only the int8 model is held to the tolerance, the float32 export must match almost exactly
+        required = tolerance if quantized else max(tolerance, 0.9999)
+        ok = bool(cosine.min() >= required)
+        passed = passed and ok
+        label = "int8" if quantized else "float32"
+        print(f"   {'✅' if ok else '❌'} {label}: cosine min {cosine.min():.5f}, mean {cosine.mean():.5f} "
+              f"(required {required}), {onnx_ms:.2f} ms/text")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the sentence transformer to ONNX and verify it")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--output-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--check-only", action="store_true", help="Only compare an existing export to PyTorch")
+    parser.add_argument("--samples", type=int, default=200, help="Number of texts to compare")
+    parser.add_argument("--tolerance", type=float, default=0.99,
+                        help="Minimum cosine similarity between int8 ONNX and PyTorch embeddings")
+    args = parser.parse_args()
+
+    if not args.check_only:
+        export(args.model, args.output_dir)
+    if not check(args.model, args.output_dir, args.samples, args.tolerance):
+        print("❌ ONNX embeddings differ from PyTorch beyond the tolerance")
+        sys.exit(1)
+    print("✅ ONNX encoder matches PyTorch within tolerance")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import logging
+import numpy as np
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from bm25 import BM25Index
+from chunk_store import ChunkStore
+from metrics import stage
+from tokenizer import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODES = ("dense", "hybrid")
+FUSION_METHODS = ("rrf", "weighted")
+
+class HybridRetriever:
+    """
+    Fuses BM25 keyword search with dense cosine scores over the same chunk rows
+
+    BM25 runs over the chunk store rows, and the dense pass rescores candidate rows exactly
+    from the normalized embeddings matrix. With prefilter, only the BM25 candidates are
+    scored densely, so the dense cost depends on the candidate count rather than the corpus;
+    the full vector search is only used when keywords find too few candidates. Without
+    prefilter, the vector search's own top candidates are fused in as well.
+
+    Fusion only decides the order. Each hit is returned with its cosine similarity, not its
+    fused score, so relevance thresholds mean the same as in dense mode: reciprocal rank
+    fusion scores reflect ranks alone, and every candidate gets one.
+    """
+
+    def __init__(self, chunks: ChunkStore, embeddings: np.ndarray, fusion: str = "rrf",
+                 candidates: int = 100, prefilter: bool = True, rrf_k: int = 60, dense_weight: float = 0.5,
+                 use_stemming: bool = False):
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method {fusion!r}, expected one of {', '.join(FUSION_METHODS)}")
+        self.embeddings = embeddings
+        self.fusion = fusion
+        self.candidates = candidates
+        self.prefilter = prefilter
+        self.rrf_k = rrf_k
+        self.dense_weight = dense_weight
+
+        self.tokenizer = Tokenizer(use_stemming=use_stemming)
+        self.bm25 = BM25Index()
+        for row in range(len(chunks)):
+            self.bm25.add(self.tokenizer.encode(chunks.text(row)))
+        self.bm25.finalize()
+        logger.info(f"Hybrid retriever: BM25 over {len(chunks)} chunks, {self.bm25.num_terms} terms")
+
+    def search(self, query: str, query_embedding: np.ndarray, top_k: int = 5,
+               dense_search: Optional[Callable[[int], List[Tuple[int, float]]]] = None) -> List[Tuple[int, float]]:
+        """
+        Return the top_k (row, cosine similarity) pairs for a query, best fused score first
+
+        Args:
+            query: The query text, tokenized for BM25
+            query_embedding: The normalized query embedding
+            top_k: Number of results
+            dense_search: Vector index search returning (row, score) pairs for k, used when
+                the keyword candidates are not enough
+        """
+        batch_dense_search = None
+        if dense_search is not None:
+            batch_dense_search = lambda query_embeddings, k: [dense_search(k)]
+        return self.search_batch([query], query_embedding[None, :], top_k, batch_dense_search)[0]
+
+    def search_batch(self, queries: List[str], query_embeddings: np.ndarray, top_k: int = 5,
+                     dense_search: Optional[Callable[[np.ndarray, int], List[List[Tuple[int, float]]]]] = None
+                     ) -> List[List[Tuple[int, float]]]:
+        """
+        search() for several queries at once
+
+        BM25 runs query by query, but the vector index fallback is one search over the queries
+        that need it, and the dense rescoring is one matrix product over the union of every
+        query's candidate rows.
+
+        Args:
+            queries: The query texts, tokenized for BM25
+            query_embeddings: The normalized query embeddings, one row per query
+            top_k: Number of results per query
+            dense_search: Vector index search returning (row, score) pairs for k, for each of
+                the given query embeddings
+        """
+        with stage("search"):
+            sparse: List[Tuple[List[Tuple[int, float]], float]] = []
+            candidates: List[Set[int]] = []
+            for query in queries:
+                query_ids = self.tokenizer.encode_query(query)
+                sparse_hits = self.bm25.search(query_ids, self.candidates)
+                sparse.append((sparse_hits, self.bm25.max_score(query_ids)))
+                candidates.append({row for row, _ in sparse_hits})
+
+            if dense_search is not None:
+                fallback = [i for i, (sparse_hits, _) in enumerate(sparse)
+                            if not self.prefilter or len(sparse_hits) < top_k]
+                if fallback:
+                    for i, dense_hits in zip(fallback, dense_search(query_embeddings[fallback], self.candidates)):
+                        candidates[i].update(row for row, _ in dense_hits)
+
+        all_rows = set().union(*candidates)
+        if not all_rows:
+            return [[] for _ in queries]
+
+        with stage("scoring"):
+            # Exact cosine similarity of every candidate of every query, from the stored embeddings
+            union_rows = np.fromiter(sorted(all_rows), dtype='int64', count=len(all_rows))
+            scores = np.asarray(self.embeddings[union_rows], dtype='float32') @ query_embeddings.T
+            positions = {row: i for i, row in enumerate(union_rows.tolist())}
+
+            results = []
+            for column, (sparse_hits, max_sparse), rows in zip(scores.T, sparse, candidates):
+                rows = sorted(rows)
+                dense = dict(zip(rows, column[[positions[row] for row in rows]].tolist()))
+                if self.fusion == "rrf":
+                    fused = self._reciprocal_rank_fusion(sparse_hits, dense)
+                else:
+                    fused = self._weighted_fusion(sparse_hits, max_sparse, dense)
+                ranking = sorted(fused, key=fused.get, reverse=True)[:top_k]
+                results.append([(row, dense[row]) for row in ranking])
+            return results
+
+    def _reciprocal_rank_fusion(self, sparse_hits: List[Tuple[int, float]], dense: Dict[int, float]) -> Dict[int, float]:
+        k = self.rrf_k
+        fused: Dict[int, float] = {}
+        for rank, (row, _) in enumerate(sparse_hits, start=1):
+            fused[row] = 1 / (k + rank)
+        dense_ranking = sorted(dense, key=dense.get, reverse=True)
+        for rank, row in enumerate(dense_ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1 / (k + rank)
+        return fused
+
+    def _weighted_fusion(self, sparse_hits: List[Tuple[int, float]], max_sparse: float,
+                         dense: Dict[int, float]) -> Dict[int, float]:
+        sparse = {row: score / max_sparse for row, score in sparse_hits} if max_sparse else {}
+        weight = self.dense_weight
+        return {row: weight * max(score, 0.0) + (1 - weight) * sparse.get(row, 0.0)
+                for row, score in dense.items()}
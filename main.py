@@ -1,13 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
 import base64
 import json
 import time
-from utils import TDSVirtualTA
+import os
+import psutil
+from api import (REQUEST_TIMEOUT, BatchRequest, BatchResponse, QueryRequest, QueryResponse, answer_batch_request,
+                 answer_items, api_call, stream_question)
+from admin import require_admin
+from batching import QueryBatcher
+from metrics import CONTENT_TYPE, REGISTRY, collect_timings, monitor_event_loop, update_gauges
+from profiling import ProfilerBusy, profile
+from startup import BackgroundLoader, NotReady
+from workers import pool_from_env
+import asyncio
 
-app = FastAPI(title="TDS Virtual TA API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The index loads in the background so /health answers while it does
+    loader.start()
+    lag_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    lag_monitor.cancel()
+
+app = FastAPI(title="TDS Virtual TA API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -18,58 +38,193 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-class QueryRequest(BaseModel):
-    question: str
-    image: Optional[str] = None  # base64 encoded image
+# Workers started by serve.py map one shared prebuilt index read-only
+SHARED_INDEX = os.environ.get("TA_SHARED_INDEX") == "1"
+
+def load_virtual_ta():
+    """Import the ML stack and load the search index, runs in the background at startup"""
+    from utils import TDSVirtualTA, INDEX_DIR, DEFAULT_INDEX_TYPE, DEFAULT_ENCODER
+    
+    print("Initializing TDS Virtual TA...")
+    virtual_ta = TDSVirtualTA(
+        index_dir=os.environ.get("TA_INDEX_DIR", INDEX_DIR),
+        index_type=os.environ.get("TA_INDEX_TYPE", DEFAULT_INDEX_TYPE),
+        # BM25 + dense fusion by default, TA_RETRIEVAL=dense for vector search only
+        retrieval=os.environ.get("TA_RETRIEVAL", "hybrid"),
+        fusion=os.environ.get("TA_FUSION", "rrf"),
+        use_stemming=os.environ.get("TA_STEMMING") == "1",
+        encoder=os.environ.get("TA_ENCODER", DEFAULT_ENCODER),
+        answer_cache_size=int(os.environ.get("TA_ANSWER_CACHE_SIZE", 1024)),
+        read_only=SHARED_INDEX
+    )
+    if os.environ.get("TA_WARM_MODEL", "1") == "1":
+        # Load the encoder before reporting ready, so the first question does not wait for it
+        virtual_ta.model
+    print("TDS Virtual TA initialized successfully!")
+    return virtual_ta
+
+loader = BackgroundLoader(load_virtual_ta, name="TDS Virtual TA")
+
+def answer_question(question: str, image_base64: Optional[str]):
+    with collect_timings() as timings:
+        answer, links = loader.get().answer_question(question=question, image_base64=image_base64)
+    return answer, links, timings
 
-class QueryResponse(BaseModel):
-    answer: str
-    links: List[Dict[str, str]]
+def answer_batch(items: List[Tuple[str, Optional[str]]]):
+    with collect_timings() as timings:
+        results = answer_items(loader.get(), items)
+    return results, timings
 
-# Initialize the virtual TA system
-print("Initializing TDS Virtual TA...")
-virtual_ta = TDSVirtualTA()
-print("TDS Virtual TA initialized successfully!")
+def stream_answer(question: str, image_base64: Optional[str]):
+    with collect_timings() as timings:
+        links, pieces = loader.get().stream_answer(question=question, image_base64=image_base64)
+    # The links and retrieval timings go out first, the pieces as the worker produces them
+    return (links, timings), pieces
+
+def answer_questions(questions: List[str]):
+    # Every question of a batch shares the batch's stage timings
+    with collect_timings() as timings:
+        results = loader.get().answer_questions(questions)
+    return [(answer, links, timings) for answer, links in results]
+
+# Search runs in a bounded pool so the event loop stays responsive
+worker_pool = pool_from_env()
+
+# Questions arriving within a few milliseconds are encoded and searched together
+batcher = QueryBatcher(
+    answer_questions,
+    max_batch_size=int(os.environ.get("TA_BATCH_SIZE", 32)),
+    max_wait_ms=float(os.environ.get("TA_BATCH_WAIT_MS", 5)),
+    executor=worker_pool.executor
+)
 
 @app.post("/api/", response_model=QueryResponse)
-async def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, response: Response, x_timing: Optional[str] = Header(None),
+                       accept: Optional[str] = Header(None)):
     """
     Answer student questions based on TDS course content and discourse posts.
     
     Args:
         request: Contains the question and optional base64 image
+        x_timing: Any value asks for per-stage timings in the X-Timing response header
+        accept: text/event-stream streams Server-Sent Events instead of JSON lines
         
     Returns:
-        JSON response with answer and relevant links
+        JSON response with answer and relevant links, or with stream set, a stream of
+        links, answer and done events that starts as soon as the links are found
     """
-    start_time = time.time()
-    
-    try:
+    with api_call("/api/", REQUEST_TIMEOUT) as call:
         # Validate request
         if not request.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
+        # Fail fast while the index is still loading
+        loader.get()
         
-        # Process the question (with or without image)
-        answer, links = virtual_ta.answer_question(
-            question=request.question.strip(),
-            image_base64=request.image
-        )
+        # Streamed questions skip the batcher: their links go out as soon as their own search is done
+        if request.stream:
+            return await stream_question(call, request, accept, x_timing, worker_pool, stream_answer)
         
-        # Check if response time is within 30 seconds
-        response_time = time.time() - start_time
-        if response_time > 30:
-            print(f"Warning: Response took {response_time:.2f} seconds")
+        # Process the question (with or without image)
+        if request.image:
+            answer, links, call.timings = await worker_pool.run(
+                answer_question, request.question.strip(), request.image, timeout=REQUEST_TIMEOUT
+            )
+        else:
+            # The slot is given back when the batch finishes, not when this request stops waiting
+            worker_pool.acquire()
+            answer, links, call.timings = await worker_pool.wait(
+                batcher.enqueue(request.question.strip(), on_done=worker_pool.release), REQUEST_TIMEOUT
+            )
         
+        call.outcome = "ok"
+        call.add_timing(response.headers, x_timing)
         return QueryResponse(answer=answer, links=links)
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def ask_questions(request: BatchRequest, response: Response, x_timing: Optional[str] = Header(None)):
+    """
+    Answer many questions in one request, for evaluation runs and offline grading.
+    Questions without images are encoded in one model call and rescored in one
+    matrix product (one vector index search in dense mode), with one BM25 search each.
+    
+    Args:
+        request: Up to TA_API_BATCH_MAX questions, each like a POST /api/ body
+        x_timing: Any value asks for per-stage timings of the whole batch in the X-Timing header
         
-    except Exception as e:
-        print(f"Error processing question: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    Returns:
+        One result per question in the same order, with an error instead of an answer
+        for a question that cannot be answered
+    """
+    return await answer_batch_request(request, response, x_timing, loader, worker_pool, answer_batch)
+
+@app.post("/admin/reindex")
+async def reindex(x_admin_token: Optional[str] = Header(None)):
+    """Re-chunk and re-embed only the course pages and posts that changed on disk"""
+    require_admin(x_admin_token)
+    try:
+        virtual_ta = loader.get()
+    except NotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    if virtual_ta.read_only:
+        raise HTTPException(status_code=409, detail="Index is shared read-only. Rebuild it with build_index.py and restart serve.py.")
+    if worker_pool.kind == "process":
+        # Forked workers would keep answering from the index they were forked with
+        raise HTTPException(status_code=409, detail="Worker processes keep the index they were forked with. Restart the server to re-index.")
+    
+    start_time = time.time()
+    stats = await run_in_threadpool(virtual_ta.reindex)
+    return {"status": "ok", "elapsed_seconds": round(time.time() - start_time, 2), **stats}
+
+@app.post("/admin/profile")
+async def admin_profile(seconds: float = 10, output: str = "folded", interval_ms: float = 5, idle: bool = False,
+                        x_admin_token: Optional[str] = Header(None)):
+    """
+    Profile the live process for a few seconds while it serves traffic
+    
+    Args:
+        seconds: Length of the profile, at most 60
+        output: "folded" stacks for a flamegraph, "top" functions, or "memory" growth from tracemalloc
+        interval_ms: Milliseconds between stack samples
+        idle: Also count threads that are waiting for work
+    """
+    require_admin(x_admin_token)
+    try:
+        report = await run_in_threadpool(profile, seconds, output, interval_ms / 1000, idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PlainTextResponse(report)
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "message": "TDS Virtual TA is running"}
+    """Liveness check with memory usage, answers as soon as the server is listening"""
+    status = {
+        "status": "healthy",
+        "message": "TDS Virtual TA is running",
+        **loader.status(),
+        "memory_usage_mb": round(psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024, 2),
+        "batching": batcher.stats(),
+        "workers": worker_pool.stats()
+    }
+    if loader.ready:
+        status["cache"] = loader.get().cache_stats()
+    return status
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check, 200 once the search index is loaded and questions can be answered"""
+    if not loader.ready:
+        status = "failed" if loader.error else "loading"
+        return JSONResponse(status_code=503, content={"status": status, **loader.status()})
+    return {"status": "ready", **loader.status()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: requests by outcome, per-stage latency histograms, index size and memory"""
+    update_gauges(loader.get() if loader.ready else None, worker_pool, ready=loader.ready)
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 @app.get("/")
 async def root():
@@ -78,8 +233,13 @@ async def root():
         "message": "TDS Virtual TA API",
         "version": "1.0.0",
         "endpoints": {
-            "POST /api/": "Submit a question (with optional image)",
-            "GET /health": "Health check",
+            "POST /api/": "Submit a question (with optional image), with stream=true the links arrive first",
+            "POST /api/batch": "Submit many questions at once, results in order",
+            "GET /health": "Liveness check with memory usage",
+            "GET /ready": "Readiness check (503 while the index loads)",
+            "GET /metrics": "Prometheus metrics",
+            "POST /admin/reindex": "Re-index changed documents (requires X-Admin-Token)",
+            "POST /admin/profile": "Sample the live process for a flamegraph (requires X-Admin-Token)",
             "GET /": "API information"
         }
     }
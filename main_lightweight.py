@@ -1,15 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
 import base64
 import json
-import time
 import psutil
 import os
+import asyncio
 from utils_lightweight import LightweightTDSVirtualTA
+from api import (REQUEST_TIMEOUT, BatchRequest, BatchResponse, QueryRequest, QueryResponse, answer_batch_request,
+                 answer_items, api_call, stream_question)
+from admin import require_admin
+from metrics import CONTENT_TYPE, REGISTRY, collect_timings, monitor_event_loop, update_gauges
+from profiling import ProfilerBusy, profile
+from startup import BackgroundLoader
+from workers import pool_from_env
 
-app = FastAPI(title="TDS Virtual TA API (Lightweight)", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The keyword index builds in the background so /health answers while it does
+    loader.start()
+    lag_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    lag_monitor.cancel()
+
+app = FastAPI(title="TDS Virtual TA API (Lightweight)", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,72 +37,146 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-class QueryRequest(BaseModel):
-    question: str
-    image: Optional[str] = None  # base64 encoded image
-
-class QueryResponse(BaseModel):
-    answer: str
-    links: List[Dict[str, str]]
-
 def get_memory_usage():
     """Get current memory usage in MB"""
     process = psutil.Process(os.getpid())
     return process.memory_info().rss / 1024 / 1024
 
-# Initialize the lightweight virtual TA system
-print("Initializing Lightweight TDS Virtual TA...")
-print(f"Initial memory usage: {get_memory_usage():.2f} MB")
-virtual_ta = LightweightTDSVirtualTA()
-print(f"Memory usage after initialization: {get_memory_usage():.2f} MB")
-print("Lightweight TDS Virtual TA initialized successfully!")
+def load_virtual_ta():
+    """Load the corpus and build the keyword index, runs in the background at startup"""
+    print("Initializing Lightweight TDS Virtual TA...")
+    print(f"Initial memory usage: {get_memory_usage():.2f} MB")
+    virtual_ta = LightweightTDSVirtualTA(
+        answer_cache_size=int(os.environ.get("TA_ANSWER_CACHE_SIZE", 1024)),
+        use_stemming=os.environ.get("TA_STEMMING") == "1"
+    )
+    print(f"Memory usage after initialization: {get_memory_usage():.2f} MB")
+    print("Lightweight TDS Virtual TA initialized successfully!")
+    return virtual_ta
+
+loader = BackgroundLoader(load_virtual_ta, name="Lightweight TDS Virtual TA")
+
+def answer_question(question: str, image_base64: Optional[str]):
+    with collect_timings() as timings:
+        answer, links = loader.get().answer_question(question=question, image_base64=image_base64)
+    return answer, links, timings
+
+def answer_batch(items: List[Tuple[str, Optional[str]]]):
+    with collect_timings() as timings:
+        results = answer_items(loader.get(), items)
+    return results, timings
+
+def stream_answer(question: str, image_base64: Optional[str]):
+    with collect_timings() as timings:
+        links, pieces = loader.get().stream_answer(question=question, image_base64=image_base64)
+    # The links and retrieval timings go out first, the pieces as the worker produces them
+    return (links, timings), pieces
+
+# Search runs in a bounded pool so the event loop stays responsive
+worker_pool = pool_from_env()
 
 @app.post("/api/", response_model=QueryResponse)
-async def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, response: Response, x_timing: Optional[str] = Header(None),
+                       accept: Optional[str] = Header(None)):
     """
     Answer student questions based on TDS course content and discourse posts.
     Memory-efficient implementation using keyword-based search.
     
     Args:
         request: Contains the question and optional base64 image
+        x_timing: Any value asks for per-stage timings in the X-Timing response header
+        accept: text/event-stream streams Server-Sent Events instead of JSON lines
         
     Returns:
-        JSON response with answer and relevant links
+        JSON response with answer and relevant links, or with stream set, a stream of
+        links, answer and done events that starts as soon as the links are found
     """
-    start_time = time.time()
-    
-    try:
+    with api_call("/api/", REQUEST_TIMEOUT) as call:
         # Validate request
         if not request.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
+        # Fail fast while the index is still loading
+        loader.get()
+        
+        if request.stream:
+            return await stream_question(call, request, accept, x_timing, worker_pool, stream_answer)
         
         # Process the question (with or without image)
-        answer, links = virtual_ta.answer_question(
-            question=request.question.strip(),
-            image_base64=request.image
+        answer, links, call.timings = await worker_pool.run(
+            answer_question, request.question.strip(), request.image, timeout=REQUEST_TIMEOUT
         )
         
-        # Check if response time is within 30 seconds
-        response_time = time.time() - start_time
-        if response_time > 30:
-            print(f"Warning: Response took {response_time:.2f} seconds")
-        
+        call.outcome = "ok"
+        call.add_timing(response.headers, x_timing)
         return QueryResponse(answer=answer, links=links)
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def ask_questions(request: BatchRequest, response: Response, x_timing: Optional[str] = Header(None)):
+    """
+    Answer many questions in one request, for evaluation runs and offline grading.
+    Saves the per-request HTTP overhead of one POST /api/ per question; each
+    question is still one BM25 search.
+    
+    Args:
+        request: Up to TA_API_BATCH_MAX questions, each like a POST /api/ body
+        x_timing: Any value asks for per-stage timings of the whole batch in the X-Timing header
         
-    except Exception as e:
-        print(f"Error processing question: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    Returns:
+        One result per question in the same order, with an error instead of an answer
+        for a question that cannot be answered
+    """
+    return await answer_batch_request(request, response, x_timing, loader, worker_pool, answer_batch)
+
+@app.post("/admin/profile")
+async def admin_profile(seconds: float = 10, output: str = "folded", interval_ms: float = 5, idle: bool = False,
+                        x_admin_token: Optional[str] = Header(None)):
+    """
+    Profile the live process for a few seconds while it serves traffic
+    
+    Args:
+        seconds: Length of the profile, at most 60
+        output: "folded" stacks for a flamegraph, "top" functions, or "memory" growth from tracemalloc
+        interval_ms: Milliseconds between stack samples
+        idle: Also count threads that are waiting for work
+    """
+    require_admin(x_admin_token)
+    try:
+        report = await run_in_threadpool(profile, seconds, output, interval_ms / 1000, idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PlainTextResponse(report)
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint with memory usage"""
+    """Liveness check with memory usage, answers as soon as the server is listening"""
     memory_usage = get_memory_usage()
-    return {
+    status = {
         "status": "healthy", 
         "message": "TDS Virtual TA is running",
+        **loader.status(),
         "memory_usage_mb": round(memory_usage, 2),
-        "memory_limit_mb": 512
+        "memory_limit_mb": 512,
+        "workers": worker_pool.stats()
     }
+    if loader.ready:
+        status["cache"] = loader.get().cache_stats()
+    return status
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check, 200 once the keyword index is built and questions can be answered"""
+    if not loader.ready:
+        status = "failed" if loader.error else "loading"
+        return JSONResponse(status_code=503, content={"status": status, **loader.status()})
+    return {"status": "ready", **loader.status()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: requests by outcome, per-stage latency histograms, index size and memory"""
+    update_gauges(loader.get() if loader.ready else None, worker_pool, ready=loader.ready)
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 @app.get("/")
 async def root():
@@ -96,8 +187,12 @@ async def root():
         "version": "1.0.0",
         "memory_usage_mb": round(memory_usage, 2),
         "endpoints": {
-            "POST /api/": "Submit a question (with optional image)",
-            "GET /health": "Health check with memory usage",
+            "POST /api/": "Submit a question (with optional image), with stream=true the links arrive first",
+            "POST /api/batch": "Submit many questions at once, results in order",
+            "GET /health": "Liveness check with memory usage",
+            "GET /ready": "Readiness check (503 while the index builds)",
+            "GET /metrics": "Prometheus metrics",
+            "POST /admin/profile": "Sample the live process for a flamegraph (requires X-Admin-Token)",
             "GET /": "API information"
         }
     }
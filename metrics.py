@@ -0,0 +1,230 @@
+import os
+import time
+import psutil
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond keyword search to a slow first encode
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests by outcome"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. memory or index size, set when /metrics is scraped"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram(_Metric):
+    """Distribution of durations in cumulative buckets, so percentiles can be computed by the scraper"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("ta_requests_total", "Requests by endpoint and outcome", ["endpoint", "outcome"])
+REQUEST_SECONDS = REGISTRY.histogram("ta_request_seconds", "Request latency by endpoint", ["endpoint"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "ta_stage_seconds",
+    "Time spent per call in each answering stage (encode, search, scoring, answer, links) "
+    "and waiting for a worker or batch (wait)",
+    ["stage"]
+)
+EVENT_LOOP_LAG = REGISTRY.histogram("ta_event_loop_lag_seconds", "How late the event loop runs a scheduled callback")
+READY = REGISTRY.gauge("ta_ready", "1 once the search engine is loaded")
+INDEX_CHUNKS = REGISTRY.gauge("ta_index_chunks", "Chunks in the search index")
+INDEX_VECTORS = REGISTRY.gauge("ta_index_vectors", "Vectors in the FAISS index")
+MEMORY_RSS = REGISTRY.gauge("ta_memory_rss_bytes", "Resident set size of the server process")
+CACHE_ENTRIES = REGISTRY.gauge("ta_cache_entries", "Entries in each cache", ["cache"])
+CACHE_LOOKUPS = REGISTRY.gauge("ta_cache_lookups", "Cache lookups by result since startup", ["cache", "result"])
+WORKERS_IN_FLIGHT = REGISTRY.gauge("ta_workers_in_flight", "Requests running or queued in the worker pool")
+WORKERS_REJECTED = REGISTRY.gauge("ta_workers_rejected", "Requests rejected by the worker pool since startup")
+
+_local = threading.local()
+
+@contextmanager
+def stage(name: str):
+    """Time a stage into ta_stage_seconds and the timings of the request running on this thread"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Collect the stage timings of the work done on this thread inside the block"""
+    previous = getattr(_local, "timings", None)
+    timings: Dict[str, float] = {}
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+def timing_header(timings: Dict[str, float], total: float) -> str:
+    """X-Timing value in Server-Timing syntax, durations in milliseconds"""
+    wait = max(total - sum(timings.values()), 0.0)
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    parts += [f"wait;dur={wait * 1000:.2f}", f"total;dur={total * 1000:.2f}"]
+    return ", ".join(parts)
+
+def observe_request(endpoint: str, outcome: str, seconds: float, timings: Optional[Dict[str, float]] = None):
+    """Count a finished request, and record how long it waited outside the answering stages"""
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    if timings is not None:
+        STAGE_SECONDS.observe(max(seconds - sum(timings.values()), 0.0), stage="wait")
+
+def update_gauges(virtual_ta, worker_pool=None, ready: bool = True):
+    """Refresh the gauges from the engine and the worker pool before rendering"""
+    MEMORY_RSS.set(psutil.Process(os.getpid()).memory_info().rss)
+    READY.set(1 if ready else 0)
+    if worker_pool is not None:
+        pool_stats = worker_pool.stats()
+        WORKERS_IN_FLIGHT.set(pool_stats["in_flight"])
+        WORKERS_REJECTED.set(pool_stats["rejected"])
+    if virtual_ta is None:
+        return
+    INDEX_CHUNKS.set(len(virtual_ta.chunks))
+    index = getattr(virtual_ta, "index", None)
+    if index is not None:
+        INDEX_VECTORS.set(index.ntotal)
+    for cache, cache_stats in virtual_ta.cache_stats().items():
+        CACHE_ENTRIES.set(cache_stats["size"], cache=cache)
+        CACHE_LOOKUPS.set(cache_stats["hits"], cache=cache, result="hit")
+        CACHE_LOOKUPS.set(cache_stats["misses"], cache=cache, result="miss")
+
+async def monitor_event_loop(interval: float = 0.25):
+    """Measure event loop lag: how much later than scheduled a sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
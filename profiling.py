@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Tuple
+
+PROFILE_FORMATS = ("folded", "top", "memory")
+MAX_PROFILE_SECONDS = 60.0
+
+# Leaf frames of threads that are waiting for work rather than doing any
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+}
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+_profile_lock = threading.Lock()
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+def sample_stacks(seconds: float, interval: float = 0.005, include_idle: bool = False) -> Tuple[Counter, int]:
+    """
+    Sample the Python stack of every thread every interval seconds
+
+    Returns (count of each stack, number of sampling rounds). Stacks are tuples of frame
+    labels from the thread name down to the innermost frame. Threads parked waiting for
+    work are skipped unless include_idle is set, so the counts show where time goes.
+    """
+    stacks: Counter = Counter()
+    me = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    rounds = 0
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (not include_idle and _is_idle(frame)):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[tuple(reversed(labels))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+def format_folded(stacks: Counter) -> str:
+    """Collapsed stacks, one 'frame;frame;frame count' line each, for flamegraph.pl or speedscope"""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+def format_top(stacks: Counter, rounds: int, seconds: float, interval: float, limit: int = 40) -> str:
+    """pstats-style table of the functions with the most samples, on the CPU itself and below it"""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for label in set(stack[1:]):
+            total[label] += count
+    samples = sum(stacks.values())
+    lines = [
+        f"{samples} busy thread samples in {rounds} rounds over {seconds:.1f}s ({interval * 1000:.0f} ms interval)",
+        "",
+        f"{'own':>8} {'own%':>6} {'total':>8} {'total%':>6}  function",
+    ]
+    # Hottest functions first, callers that only wrap them by their total time after
+    for label in sorted(total, key=lambda label: (own[label], total[label]), reverse=True)[:limit]:
+        lines.append(f"{own[label]:>8} {100 * own[label] / max(samples, 1):>6.1f} "
+                     f"{total[label]:>8} {100 * total[label] / max(samples, 1):>6.1f}  {label}")
+    return "\n".join(lines) + "\n"
+
+def trace_allocations(seconds: float, limit: int = 30, frames: int = 10) -> str:
+    """Memory allocated and still held after seconds, by source line, using tracemalloc"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    lines = [
+        f"Traced memory after {seconds:.1f}s: {current / 1024 / 1024:.1f} MB (peak {peak / 1024 / 1024:.1f} MB)"
+        + ("" if started else ", tracing since before this profile"),
+        "",
+        f"{'growth':>12} {'blocks':>8}  location",
+    ]
+    for stat in differences[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:>10.1f}KB {stat.count_diff:>+8}  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+def profile(seconds: float, output: str = "folded", interval: float = 0.005, include_idle: bool = False) -> str:
+    """
+    Profile the running process for a time-boxed window, one profile at a time
+
+    Args:
+        seconds: Length of the window, capped at MAX_PROFILE_SECONDS
+        output: "folded" (flamegraph input), "top" (hottest functions) or "memory" (tracemalloc growth)
+        interval: Seconds between stack samples
+        include_idle: Also count threads waiting for work
+
+    Raises:
+        ProfilerBusy: another profile is running
+        ValueError: unknown output format
+    """
+    if output not in PROFILE_FORMATS:
+        raise ValueError(f"Unknown profile format {output!r}, expected one of {', '.join(PROFILE_FORMATS)}")
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    interval = max(interval, 0.001)
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        if output == "memory":
+            return trace_allocations(seconds)
+        stacks, rounds = sample_stacks(seconds, interval, include_idle)
+        if output == "folded":
+            return format_folded(stacks)
+        return format_top(stacks, rounds, seconds, interval)
+    finally:
+        _profile_lock.release()
@@ -1,84 +1,237 @@
 # ✅ scrape_course.py
 import os
-import json
 import re
+import json
+import asyncio
+import hashlib
+import argparse
+import posixpath
 from datetime import datetime
-from urllib.parse import urljoin
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
 from markdownify import markdownify as md
-from playwright.sync_api import sync_playwright
 
 BASE_URL = "https://tds.s-anand.net/#/2025-01/"
 BASE_ORIGIN = "https://tds.s-anand.net"
 OUTPUT_DIR = "tds_pages_md"
 METADATA_FILE = "metadata.json"
-
-visited = set()
-metadata = []
+CONCURRENCY = 6
+ARTICLE_SELECTOR = "article.markdown-section#main"
+PAGE_TIMEOUT_MS = 15000
+
+# Docsify replaces the article's content when it renders a route, which removes this marker
+STALE_MARKER_ID = "crawler-stale-marker"
+MARK_STALE_JS = f"""() => {{
+    const article = document.querySelector('{ARTICLE_SELECTOR}');
+    if (article && !document.getElementById('{STALE_MARKER_ID}')) {{
+        const marker = document.createElement('span');
+        marker.id = '{STALE_MARKER_ID}';
+        article.appendChild(marker);
+    }}
+}}"""
+RENDERED_JS = f"""() => {{
+    const article = document.querySelector('{ARTICLE_SELECTOR}');
+    return article && !document.getElementById('{STALE_MARKER_ID}')
+        && article.innerText.trim().length > 0 && !article.querySelector('.progress');
+}}"""
+NOT_FOUND_PATTERN = re.compile(r'^\s*404\b')
 
 def sanitize_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "_", title).strip().replace(" ", "_")
 
-def extract_all_internal_links(page):
-    links = page.eval_on_selector_all("a[href]", "els => els.map(el => el.href)")
-    return list(set(link for link in links if BASE_ORIGIN in link and '/#/' in link))
-
-def wait_for_article_and_get_html(page):
-    page.wait_for_selector("article.markdown-section#main", timeout=10000)
-    return page.inner_html("article.markdown-section#main")
-
-def crawl_page(page, url):
-    if url in visited:
-        return
-    visited.add(url)
-
-    print(f"📄 Visiting: {url}")
-    try:
-        page.goto(url, wait_until="domcontentloaded")
-        page.wait_for_timeout(1000)
-        html = wait_for_article_and_get_html(page)
-    except Exception as e:
-        print(f"❌ Error loading page: {url}\n{e}")
-        return
-
-    title = page.title().split(" - ")[0].strip() or f"page_{len(visited)}"
-    filename = sanitize_filename(title)
-    filepath = os.path.join(OUTPUT_DIR, f"{filename}.md")
-
-    markdown = md(html)
-    with open(filepath, "w", encoding="utf-8") as f:
+def canonical_url(url: str, base: str = BASE_URL) -> Optional[str]:
+    """
+    The one URL a course page is crawled and saved under, or None for links off the site
+
+    Docsify routes live in the fragment: '#/../foo', '#/foo' and '#/foo?id=section' all
+    render the page '#/foo', so the route is resolved and its section query dropped.
+    """
+    absolute = urljoin(base, url)
+    parts = urlsplit(absolute)
+    if f"{parts.scheme}://{parts.netloc}" != BASE_ORIGIN or not parts.fragment.startswith("/"):
+        return None
+    route = parts.fragment.split("?", 1)[0]
+    normalized = posixpath.normpath(route)
+    if route.endswith("/") and normalized != "/":
+        normalized += "/"  # '#/2025-01/' is a directory index, not the page '#/2025-01'
+    return f"{BASE_ORIGIN}/#{normalized}"
+
+def page_filename(title: str, url: str, used: Dict[str, str]) -> str:
+    """File name from the title, or from the route when another page already has that title"""
+    filename = f"{sanitize_filename(title)}.md"
+    if used.get(filename, url) != url:
+        route = url.split("#", 1)[1].strip("/") or "index"
+        filename = f"{sanitize_filename(route.replace('/', '_'))}.md"
+    used[filename] = url
+    return filename
+
+def write_page(filepath: str, title: str, url: str, downloaded_at: str, markdown: str):
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         f.write(f"---\n")
-        f.write(f"title: \"{title}\"\n")
-        f.write(f"original_url: \"{url}\"\n")
-        f.write(f"downloaded_at: \"{datetime.now().isoformat()}\"\n")
+        f.write(f"title: {json.dumps(title, ensure_ascii=False)}\n")
+        f.write(f"original_url: {json.dumps(url)}\n")
+        f.write(f"downloaded_at: \"{downloaded_at}\"\n")
         f.write(f"---\n\n")
         f.write(markdown)
-
-    metadata.append({
-        "title": title,
-        "filename": f"{filename}.md",
-        "original_url": url,
-        "downloaded_at": datetime.now().isoformat()
-    })
-
-    links = extract_all_internal_links(page)
-    for link in links:
-        crawl_page(page, link)
+    os.replace(tmp_path, filepath)
+
+class CourseCrawler:
+    """
+    Breadth-first crawl of the course site with a pool of browser pages
+
+    URLs enter the frontier in canonical form and only once; each worker page waits for
+    Docsify to finish rendering the route instead of sleeping, and pages that render to
+    the same content under different routes are saved once.
+    """
+
+    def __init__(self, start_url: str = BASE_URL, output_dir: str = OUTPUT_DIR, concurrency: int = CONCURRENCY,
+                 max_pages: Optional[int] = None):
+        self.start_url = canonical_url(start_url)
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.metadata: List[Dict[str, str]] = []
+        self.failed: List[str] = []
+        self._seen = set()
+        self._content_hashes: Dict[str, str] = {}
+        self._filenames: Dict[str, str] = {}
+        self._frontier: "asyncio.Queue[tuple]" = asyncio.Queue()
+
+    def _enqueue(self, url: Optional[str], depth: int):
+        if url is None or url in self._seen:
+            return
+        if self.max_pages is not None and len(self._seen) >= self.max_pages:
+            return
+        self._seen.add(url)
+        self._frontier.put_nowait((depth, len(self._seen), url))
+
+    async def _render(self, page, url: str) -> Optional[Dict[str, object]]:
+        """Navigate to url and return its title, article HTML and links once Docsify has rendered it"""
+        await page.evaluate(MARK_STALE_JS)
+        await page.goto(url, wait_until="domcontentloaded")
+        await page.wait_for_function(RENDERED_JS, timeout=PAGE_TIMEOUT_MS)
+        return await page.evaluate(f"""() => {{
+            const article = document.querySelector('{ARTICLE_SELECTOR}');
+            const heading = article.querySelector('h1, h2');
+            return {{
+                title: heading ? heading.innerText.trim() : document.title.split(' - ')[0].trim(),
+                html: article.innerHTML,
+                text: article.innerText,
+                links: Array.from(document.querySelectorAll('a[href]'), a => a.getAttribute('href')),
+            }};
+        }}""")
+
+    def _save(self, url: str, depth: int, order: int, rendered: Dict[str, object]):
+        markdown = md(rendered["html"])
+        digest = hashlib.sha1(markdown.encode("utf-8")).hexdigest()
+        if digest in self._content_hashes:
+            print(f"♻️  Same page as {self._content_hashes[digest]}: {url}")
+            return
+        self._content_hashes[digest] = url
+
+        title = rendered["title"] or f"page_{order}"
+        filename = page_filename(title, url, self._filenames)
+        downloaded_at = datetime.now().isoformat()
+        write_page(os.path.join(self.output_dir, filename), title, url, downloaded_at, markdown)
+        self.metadata.append({
+            "title": title,
+            "filename": filename,
+            "original_url": url,
+            "downloaded_at": downloaded_at,
+            "depth": depth,
+            "order": order,
+        })
+
+    async def _worker(self, context):
+        page = await context.new_page()
+        try:
+            while True:
+                depth, order, url = await self._frontier.get()
+                try:
+                    print(f"📄 Visiting: {url}")
+                    rendered = await self._render(page, url)
+                    if NOT_FOUND_PATTERN.match(rendered["text"]):
+                        print(f"🚫 Not found: {url}")
+                        continue
+                    self._save(url, depth, order, rendered)
+                    for link in rendered["links"]:
+                        self._enqueue(canonical_url(link, url), depth + 1)
+                except Exception as e:
+                    print(f"❌ Error loading page: {url}\n{e}")
+                    self.failed.append(url)
+                    # Start the next route from a fresh page rather than a half-rendered one
+                    try:
+                        await page.close()
+                        page = await context.new_page()
+                    except Exception as e:
+                        print(f"💥 Worker stopped, could not open a new page: {e}")
+                        page = None
+                        return
+                finally:
+                    self._frontier.task_done()
+        finally:
+            if page is not None:
+                await page.close()
+
+    async def crawl(self, headless: bool = True):
+        from playwright.async_api import async_playwright
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._enqueue(self.start_url, 0)
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(headless=headless)
+            context = await browser.new_context()
+            # Images, fonts and media are not needed to read the article
+            await context.route(re.compile(r".*\.(png|jpe?g|gif|svg|webp|woff2?|ttf|mp4|webm)(\?.*)?$"),
+                                lambda route: route.abort())
+            workers = [asyncio.create_task(self._worker(context)) for _ in range(self.concurrency)]
+            # Stop when the frontier is done, or when no worker is left to work through it
+            frontier_done = asyncio.ensure_future(self._frontier.join())
+            workers_done = asyncio.ensure_future(asyncio.gather(*workers, return_exceptions=True))
+            await asyncio.wait([frontier_done, workers_done], return_when=asyncio.FIRST_COMPLETED)
+            if not frontier_done.done():
+                print("💥 All workers stopped, giving up on the pages still queued")
+                while not self._frontier.empty():
+                    self.failed.append(self._frontier.get_nowait()[2])
+                    self._frontier.task_done()
+            frontier_done.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await browser.close()
+        self.metadata.sort(key=lambda entry: (entry["depth"], entry["order"]))
+
+def prune(output_dir: str, keep: List[str]):
+    """Remove page files an earlier crawl wrote that this crawl did not"""
+    keep = set(keep)
+    for filename in os.listdir(output_dir):
+        if filename.endswith(".md") and filename not in keep:
+            os.remove(os.path.join(output_dir, filename))
+            print(f"🗑️  Removed stale {filename}")
 
 def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    global visited, metadata
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context()
-        page = context.new_page()
-        crawl_page(page, BASE_URL)
-
-        with open(METADATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
-
-        print(f"\n✅ Completed. {len(metadata)} pages saved.")
-        browser.close()
+    parser = argparse.ArgumentParser(description="Crawl the course site into markdown files")
+    parser.add_argument("--start-url", default=BASE_URL)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Browser pages crawling at once")
+    parser.add_argument("--max-pages", type=int, default=None, help="Stop discovering pages after this many")
+    parser.add_argument("--prune", action="store_true", help="Delete files in the output dir not written by this crawl")
+    parser.add_argument("--headful", action="store_true", help="Show the browser")
+    args = parser.parse_args()
+
+    crawler = CourseCrawler(args.start_url, args.output_dir, args.concurrency, args.max_pages)
+    started = datetime.now()
+    asyncio.run(crawler.crawl(headless=not args.headful))
+
+    with open(METADATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(crawler.metadata, f, indent=2)
+    if args.prune and not crawler.failed:
+        prune(args.output_dir, [entry["filename"] for entry in crawler.metadata])
+
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"\n✅ Completed. {len(crawler.metadata)} pages saved in {elapsed:.0f}s"
+          + (f", {len(crawler.failed)} failed" if crawler.failed else ""))
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,25 @@
 # ✅ scrape_discourse.py
 import os
+import sys
 import json
-from datetime import datetime
-from playwright.sync_api import sync_playwright, TimeoutError
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from typing import Any, Dict, List, Optional
+import httpx
 from bs4 import BeautifulSoup
 
 BASE_URL = "https://discourse.onlinedegree.iitm.ac.in"
-CATEGORY_ID = 34
-CATEGORY_JSON_URL = f"{BASE_URL}/c/courses/tds-kb/{CATEGORY_ID}.json"
+CATEGORY_PATH = "c/courses/tds-kb/34"
 AUTH_STATE_FILE = "auth.json"
+CHECKPOINT_FILE = "discourse_checkpoint.jsonl"
 DATE_FROM = datetime(2025, 1, 1)
 DATE_TO = datetime(2025, 4, 14)
+CONCURRENCY = 8
+MAX_RETRIES = 5
+POSTS_PER_REQUEST = 20  # Discourse returns at most 20 posts per topic or posts.json request
 
 def parse_date(date_str):
     try:
@@ -18,103 +27,262 @@ def parse_date(date_str):
     except ValueError:
         return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
 
-def login_and_save_auth(playwright):
-    print("🔐 No auth found. Launching browser for manual login...")
-    browser = playwright.chromium.launch(headless=False)
-    context = browser.new_context()
-    page = context.new_page()
-    page.goto(f"{BASE_URL}/login")
-    print("🌐 Please log in manually using Google. Then press ▶️ (Resume) in Playwright bar.")
-    page.pause()
-    context.storage_state(path=AUTH_STATE_FILE)
-    print("✅ Login state saved.")
-    browser.close()
-
-def is_authenticated(page):
+def retry_after_seconds(value: Optional[str], default: float) -> float:
+    """Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date"""
+    if value is None:
+        return default
     try:
-        page.goto(CATEGORY_JSON_URL, timeout=10000)
-        page.wait_for_selector("pre", timeout=5000)
-        json.loads(page.inner_text("pre"))
-        return True
-    except (TimeoutError, json.JSONDecodeError):
-        return False
-
-def scrape_posts(playwright):
-    browser = playwright.chromium.launch(headless=True)
-    context = browser.new_context(storage_state=AUTH_STATE_FILE)
-    page = context.new_page()
-
-    all_topics = []
-    page_num = 0
-    while True:
-        paginated_url = f"{CATEGORY_JSON_URL}?page={page_num}"
-        print(f"📦 Fetching page {page_num}...")
-        page.goto(paginated_url)
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default  # Neither form, back off as if there was no header
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+def login_and_save_auth(base_url: str = BASE_URL):
+    """Log in through a real browser once and save its cookies, the scraper itself only needs HTTP"""
+    from playwright.sync_api import sync_playwright
+
+    print("🔐 No valid auth found. Launching browser for manual login...")
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(headless=False)
+        context = browser.new_context()
+        page = context.new_page()
+        page.goto(f"{base_url}/login")
+        print("🌐 Please log in manually using Google. Then press ▶️ (Resume) in Playwright bar.")
+        page.pause()
+        context.storage_state(path=AUTH_STATE_FILE)
+        print("✅ Login state saved.")
+        browser.close()
+
+def load_cookies(auth_file: str, base_url: str) -> httpx.Cookies:
+    """Cookies for base_url's host from a Playwright storage state file"""
+    cookies = httpx.Cookies()
+    if not os.path.exists(auth_file):
+        return cookies
+    with open(auth_file, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    host = urlparse(base_url).hostname or ""
+    for cookie in state.get("cookies", []):
+        domain = cookie.get("domain", "").lstrip(".")
+        if host == domain or host.endswith("." + domain):
+            cookies.set(cookie["name"], cookie["value"], domain=host, path=cookie.get("path", "/"))
+    return cookies
+
+def load_checkpoint(checkpoint_file: str) -> Dict[int, Dict[str, Any]]:
+    """Topics scraped by earlier (possibly interrupted) runs, by topic id; later lines win"""
+    topics: Dict[int, Dict[str, Any]] = {}
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short when the previous run was killed
+                topics[entry["id"]] = entry
+    return topics
+
+def write_atomic(path: str, write):
+    """Write a file through a temporary file so readers never see it half written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+class DiscourseScraper:
+    """
+    Fetches the topics of a Discourse category as JSON over one authenticated HTTP client
+
+    At most `concurrency` requests are in flight. Every scraped topic is appended to a
+    checkpoint file, so an interrupted run resumes where it stopped, and a topic is only
+    fetched again when its last_posted_at or bumped_at changed since it was checkpointed.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str = BASE_URL, category_path: str = CATEGORY_PATH,
+                 concurrency: int = CONCURRENCY, checkpoint_file: str = CHECKPOINT_FILE):
+        self.client = client
+        self.base_url = base_url.rstrip("/")
+        self.category_path = category_path.strip("/")
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint = load_checkpoint(checkpoint_file)
+        self.requests = 0
+        self.fetched_topics = 0
+        self.reused_topics = 0
+        self.stale_topics = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET a Discourse JSON endpoint, backing off on rate limits and server errors"""
+        for attempt in range(MAX_RETRIES):
+            async with self._semaphore:
+                self.requests += 1
+                response = await self.client.get(f"{self.base_url}/{path}", params=params)
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt == MAX_RETRIES - 1:
+                response.raise_for_status()
+                return response.json()
+            delay = retry_after_seconds(response.headers.get("Retry-After"), 2 ** attempt)
+            print(f"⏳ {response.status_code} for {path}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def is_authenticated(self) -> bool:
         try:
-            data = json.loads(page.inner_text("pre"))
-        except:
-            break
-
-        topics = data.get("topic_list", {}).get("topics", [])
-        if not topics:
-            break
-
-        all_topics.extend(topics)
-        page_num += 1
-
-    print(f"📄 Found {len(all_topics)} total topics")
-
-    filtered_posts = []
-    for topic in all_topics:
-        created_at = parse_date(topic["created_at"])
-        if DATE_FROM <= created_at <= DATE_TO:
-            topic_url = f"{BASE_URL}/t/{topic['slug']}/{topic['id']}.json"
-            page.goto(topic_url)
-            try:
-                topic_data = json.loads(page.inner_text("pre"))
-            except:
-                continue
-
-            posts = topic_data.get("post_stream", {}).get("posts", [])
-            for post in posts:
-                filtered_posts.append({
-                    "topic_title": topic.get("title"),
-                    "author": post["username"],
-                    "created_at": post["created_at"],
-                    "url": f"{BASE_URL}/t/{topic['slug']}/{topic['id']}/{post['post_number']}",
-                    "content": BeautifulSoup(post["cooked"], "html.parser").get_text()
-                })
-
-    with open("discourse.md", "w", encoding="utf-8") as f:
+            await self.get_json(f"{self.category_path}.json")
+            return True
+        except (httpx.HTTPError, json.JSONDecodeError):
+            return False
+
+    async def fetch_topic_list(self) -> List[Dict[str, Any]]:
+        """Every topic of the category, following the paginated topic list"""
+        topics = []
+        page_num = 0
+        while True:
+            print(f"📦 Fetching page {page_num}...")
+            data = await self.get_json(f"{self.category_path}.json", params={"page": page_num})
+            page_topics = data.get("topic_list", {}).get("topics", [])
+            if not page_topics:
+                break
+            topics.extend(page_topics)
+            page_num += 1
+        return topics
+
+    async def fetch_topic_posts(self, topic: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """All posts of a topic, including those past the first page of its post stream"""
+        data = await self.get_json(f"t/{topic['slug']}/{topic['id']}.json")
+        stream = data.get("post_stream", {})
+        posts = stream.get("posts", [])
+        loaded = {post["id"] for post in posts}
+        missing = [post_id for post_id in stream.get("stream", []) if post_id not in loaded]
+        batches = [missing[i:i + POSTS_PER_REQUEST] for i in range(0, len(missing), POSTS_PER_REQUEST)]
+        for more in await asyncio.gather(*(
+            self.get_json(f"t/{topic['id']}/posts.json", params={"post_ids[]": batch}) for batch in batches
+        )):
+            posts.extend(more.get("post_stream", {}).get("posts", []))
+        posts.sort(key=lambda post: post["post_number"])
+
+        return [{
+            "topic_title": topic.get("title"),
+            "author": post["username"],
+            "created_at": post["created_at"],
+            "url": f"{self.base_url}/t/{topic['slug']}/{topic['id']}/{post['post_number']}",
+            "content": BeautifulSoup(post["cooked"], "html.parser").get_text()
+        } for post in posts]
+
+    def is_fresh(self, topic: Dict[str, Any]) -> bool:
+        """True when the checkpoint holds this topic as it is now"""
+        entry = self.checkpoint.get(topic["id"])
+        return (entry is not None and entry.get("last_posted_at") == topic.get("last_posted_at")
+                and entry.get("bumped_at") == topic.get("bumped_at"))
+
+    async def scrape_topic(self, topic: Dict[str, Any], checkpoint) -> List[Dict[str, Any]]:
+        if self.is_fresh(topic):
+            self.reused_topics += 1
+            return self.checkpoint[topic["id"]]["posts"]
+
+        try:
+            posts = await self.fetch_topic_posts(topic)
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            entry = self.checkpoint.get(topic["id"])
+            if entry is None:
+                # Left out of this run's output and out of the checkpoint, so the next run retries it
+                print(f"⚠️ Skipping topic {topic['id']} ({topic.get('title')}): {e}")
+                return []
+            # The checkpoint keeps its old timestamps, so the next run fetches the topic again
+            print(f"⚠️ Using the posts of topic {topic['id']} ({topic.get('title')}) from the last run, "
+                  f"the update failed: {e}")
+            self.stale_topics += 1
+            return entry["posts"]
+        entry = {"id": topic["id"], "last_posted_at": topic.get("last_posted_at"),
+                 "bumped_at": topic.get("bumped_at"), "posts": posts}
+        self.checkpoint[topic["id"]] = entry
+        checkpoint.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        checkpoint.flush()
+        self.fetched_topics += 1
+        if self.fetched_topics % 25 == 0:
+            print(f"🧵 Fetched {self.fetched_topics} topics...")
+        return posts
+
+    async def scrape(self, date_from: datetime = DATE_FROM, date_to: datetime = DATE_TO) -> List[Dict[str, Any]]:
+        """Posts of every topic created between date_from and date_to, in topic list order"""
+        all_topics = await self.fetch_topic_list()
+        print(f"📄 Found {len(all_topics)} total topics")
+        topics = [topic for topic in all_topics if date_from <= parse_date(topic["created_at"]) <= date_to]
+
+        with open(self.checkpoint_file, "a", encoding="utf-8") as checkpoint:
+            topic_posts = await asyncio.gather(*(self.scrape_topic(topic, checkpoint) for topic in topics))
+
+        # Compact the checkpoint to one line per topic still in the date range
+        kept = [self.checkpoint[topic["id"]] for topic in topics if topic["id"] in self.checkpoint]
+        write_atomic(self.checkpoint_file, lambda f: f.writelines(
+            json.dumps(entry, ensure_ascii=False) + "\n" for entry in kept))
+        print(f"🔁 {self.fetched_topics} topics fetched, {self.reused_topics} unchanged since the last run, "
+              f"{self.stale_topics} kept from the last run after a failed update ({self.requests} requests)")
+        return [post for posts in topic_posts for post in posts]
+
+def save_posts(filtered_posts: List[Dict[str, Any]]):
+    def write_markdown(f):
         for post in filtered_posts:
             f.write(f"### {post['topic_title']}\n")
             f.write(f"**By {post['author']} on {post['created_at']}**\n")
             f.write(f"{post['content']}\n")
             f.write(f"[View Post]({post['url']})\n\n")
 
-    with open("discourse_posts.json", "w") as f:
-        json.dump(filtered_posts, f, indent=2)
-
+    write_atomic("discourse.md", write_markdown)
+    write_atomic("discourse_posts.json", lambda f: json.dump(filtered_posts, f, indent=2))
+    # One post per line, so the server can stream posts instead of loading the whole array
+    write_atomic("discourse_posts.jsonl", lambda f: f.writelines(
+        json.dumps(post, ensure_ascii=False) + "\n" for post in filtered_posts))
     print(f"✅ Saved {len(filtered_posts)} posts to discourse.md")
-    browser.close()
+
+def make_client(base_url: str, auth_file: str, concurrency: int) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        cookies=load_cookies(auth_file, base_url),
+        headers={"Accept": "application/json"},
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        timeout=30,
+        follow_redirects=True,
+    )
+
+async def scrape_posts(base_url: str = BASE_URL, category_path: str = CATEGORY_PATH,
+                       auth_file: str = AUTH_STATE_FILE, concurrency: int = CONCURRENCY,
+                       checkpoint_file: str = CHECKPOINT_FILE, date_from: datetime = DATE_FROM,
+                       date_to: datetime = DATE_TO, login: bool = True) -> List[Dict[str, Any]]:
+    async with make_client(base_url, auth_file, concurrency) as client:
+        scraper = DiscourseScraper(client, base_url, category_path, concurrency, checkpoint_file)
+        if not await scraper.is_authenticated():
+            if not login:
+                raise PermissionError(f"Not logged in to {base_url}, the cookies in {auth_file} are missing or expired")
+            print("⚠️ Session invalid. Re-authenticating...")
+            await asyncio.to_thread(login_and_save_auth, base_url)
+            client.cookies = load_cookies(auth_file, base_url)
+        return await scraper.scrape(date_from, date_to)
 
 def main():
-    with sync_playwright() as p:
-        if not os.path.exists(AUTH_STATE_FILE):
-            login_and_save_auth(p)
-        else:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(storage_state=AUTH_STATE_FILE)
-            page = context.new_page()
-            if not is_authenticated(page):
-                print("⚠️ Session invalid. Re-authenticating...")
-                browser.close()
-                login_and_save_auth(p)
-            else:
-                browser.close()
-
-        scrape_posts(p)
+    parser = argparse.ArgumentParser(description="Scrape a Discourse category into discourse.md and discourse_posts.json")
+    parser.add_argument("--base-url", default=BASE_URL, help="Discourse site, e.g. a local stand-in server for testing")
+    parser.add_argument("--category", default=CATEGORY_PATH, help="Category path, e.g. c/courses/tds-kb/34")
+    parser.add_argument("--auth", default=AUTH_STATE_FILE, help="Playwright storage state with the login cookies")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Requests in flight at once")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Per-topic progress, reused by the next run")
+    parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and fetch every topic")
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat, default=DATE_FROM)
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat, default=DATE_TO)
+    parser.add_argument("--no-login", action="store_true", help="Never open a browser to log in")
+    args = parser.parse_args()
+
+    if args.full and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    try:
+        posts = asyncio.run(scrape_posts(args.base_url, args.category, args.auth, args.concurrency, args.checkpoint,
+                                         args.date_from, args.date_to, login=not args.no_login))
+    except PermissionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    save_posts(posts)
 
 if __name__ == "__main__":
     main()
-
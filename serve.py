@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Multi-worker launcher for the full TDS Virtual TA API.
+Builds the search index once, then starts uvicorn workers that memory-map it read-only.
+The chunk store, embeddings and FAISS index are shared through the page cache. Each worker
+loads its own sentence transformer before it reports ready (TA_WARM_MODEL=0 defers that to
+the first query it encodes). With hybrid retrieval each worker also builds its own BM25
+index and vocabulary from the shared chunk store, in private memory: about 2.5 MB and a
+tenth of a second for the current corpus, small next to the model.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import uvicorn
+
+# Same default as utils.INDEX_DIR, not imported to keep the supervisor free of the ML stack
+INDEX_DIR = "index_data"
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the full TDS Virtual TA API with several workers")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--index-dir", default=os.environ.get("TA_INDEX_DIR", INDEX_DIR))
+    parser.add_argument("--index-type", default=os.environ.get("TA_INDEX_TYPE", "flat"),
+                        help="FAISS index layout: flat, ivf, ivfpq, hnsw or sq8")
+    args = parser.parse_args()
+
+    # Build (or incrementally update) the index in a separate process, so this
+    # supervisor never holds the model or the corpus in memory
+    print(f"🔨 Building search index in {args.index_dir}...")
+    subprocess.run([sys.executable, "build_index.py", "--index-dir", args.index_dir,
+                    "--index-type", args.index_type], check=True)
+
+    os.environ["TA_SHARED_INDEX"] = "1"
+    os.environ["TA_INDEX_DIR"] = args.index_dir
+    os.environ["TA_INDEX_TYPE"] = args.index_type
+    print(f"🚀 Starting {args.workers} workers sharing {args.index_dir}")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -36,7 +36,7 @@ def main():
             print("💡 Try running: python main_lightweight.py")
             sys.exit(1)
     else:
-        print("🚀 Using full version (semantic search)")
+        print("🚀 Using full version (hybrid keyword + semantic search)")
         print("📝 Starting with main.py...")
         
         # Import and run full version
@@ -0,0 +1,75 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class NotReady(Exception):
+    """Raised when the search engine is still loading (or failed to load)"""
+
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BackgroundLoader:
+    """
+    Builds a slow-to-create object in a background thread
+
+    The server can accept connections (and answer liveness checks) as soon as it starts,
+    while the search engine, its heavy imports and the index load happen here. Requests
+    that need the object before it is ready get NotReady instead of blocking.
+    """
+
+    def __init__(self, factory: Callable[[], Any], name: str = "search engine"):
+        self.factory = factory
+        self.name = name
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._value = None
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = time.time()
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start loading, once"""
+        if self._thread is None:
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        logger.info(f"Loading {self.name} in the background...")
+        try:
+            self._value = self.factory()
+        except Exception as e:
+            logger.exception(f"Failed to load {self.name}")
+            self.error = str(e)
+            return
+        self.load_seconds = round(time.time() - self._started_at, 2)
+        self._ready.set()
+        logger.info(f"{self.name} ready after {self.load_seconds}s")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until loaded, for scripts that want the old synchronous behaviour"""
+        return self._ready.wait(timeout)
+
+    def get(self) -> Any:
+        """The loaded object, raises NotReady while loading or after a failed load"""
+        if self._ready.is_set():
+            return self._value
+        if self.error is not None:
+            raise NotReady(f"{self.name} failed to load: {self.error}", retry_after=60)
+        raise NotReady(f"{self.name} is still loading")
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness details for /health and /ready"""
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "load_seconds": self.load_seconds if self.ready else round(time.time() - self._started_at, 2),
+        }
@@ -0,0 +1,44 @@
+import json
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional
+
+# Wire formats of a streamed answer, picked by the Accept header
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+# Proxies (nginx, Render) buffer responses unless told not to, which would hold back the first byte
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def stream_format(accept: Optional[str]) -> str:
+    """Server-Sent Events when the client accepts them, JSON lines otherwise"""
+    return "sse" if accept and STREAM_MEDIA_TYPES["sse"] in accept else "ndjson"
+
+def format_event(stream_format: str, event: str, data: Dict) -> str:
+    """
+    One event of a streamed answer
+
+    JSON lines carry the event name in a "type" field, e.g. {"type": "answer", "text": "..."};
+    Server-Sent Events carry it in the event field with the same JSON object as data.
+    """
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"type": event, **data}) + "\n"
+
+async def stream_answer_events(stream_format: str, links: List[Dict[str, str]],
+                               pieces: AsyncIterable[str]) -> AsyncIterator[str]:
+    """
+    Events of one answer: the links, the answer text piece by piece, then done
+
+    The links are already known when the response starts, so they reach the client with the
+    first byte, and each piece is sent as soon as it is produced; concatenating the text of
+    the answer events gives the non-streaming answer.
+    """
+    yield format_event(stream_format, "links", {"links": links})
+    try:
+        async for piece in pieces:
+            yield format_event(stream_format, "answer", {"text": piece})
+    except Exception as e:
+        # The status code is already sent, so a failure can only be reported in the stream
+        yield format_event(stream_format, "error", {"detail": f"Internal server error: {e}"})
+        return
+    yield format_event(stream_format, "done", {})
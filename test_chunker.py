@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Test that the chunker keeps every chunk of the course and discourse corpus within its token budget
+"""
+
+from chunker import MarkdownChunker, count_tokens
+from corpus import iter_documents
+
+# (max_tokens, overlap_tokens) of the full and lightweight engines
+CHUNK_SETTINGS = [(200, 20), (64, 6)]
+
+def test_chunks_within_budget():
+    """Every chunk, heading path and repeated paragraph included, is at most max_tokens"""
+    documents = list(iter_documents())
+    assert documents, "No course pages or discourse posts found"
+
+    for max_tokens, overlap_tokens in CHUNK_SETTINGS:
+        chunker = MarkdownChunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        sizes = [count_tokens(chunk.content)
+                 for doc in documents
+                 for chunk in chunker.chunk(doc.content, doc.source, url=doc.url, title=doc.title)]
+        over = [size for size in sizes if size > max_tokens]
+        print(f"{max_tokens} tokens: {len(sizes)} chunks, largest {max(sizes)}, {len(over)} over budget")
+        assert not over, f"{len(over)} chunks exceed {max_tokens} tokens, largest {max(over)}"
+
+if __name__ == "__main__":
+    test_chunks_within_budget()
+    print("✅ All chunks within budget")
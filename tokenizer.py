@@ -0,0 +1,105 @@
+import re
+from array import array
+from typing import Dict, FrozenSet, List, Optional
+
+# Runs of word characters; the same terms as replacing punctuation with spaces and splitting
+WORD_PATTERN = re.compile(r'\w+')
+
+# Common stop words, never indexed or searched
+STOP_WORDS: FrozenSet[str] = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'
+})
+
+MIN_TERM_LENGTH = 3
+# Word ids of stop words and words too short to index
+DROPPED = -1
+
+def _undouble(word: str) -> str:
+    # running -> runn -> run, but install(ed) keeps its double l
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+        return word[:-1]
+    return word
+
+def stem(word: str) -> str:
+    """
+    Strip common English inflections: plurals, -ing and -ed
+
+    A light suffix stripper rather than a full Porter stemmer: 'notebooks' and 'notebook',
+    'deploying' and 'deployed' and 'deploy' meet, while short words like 'string' are left alone.
+    """
+    if len(word) > 4 and word.endswith("ies") and not word.endswith(("eies", "aies")):
+        return word[:-3] + "y"
+    if len(word) > 6 and word.endswith("ing"):
+        return _undouble(word[:-3])
+    if len(word) > 5 and word.endswith("ed") and not word.endswith("eed"):
+        return _undouble(word[:-2])
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+class Tokenizer:
+    """
+    Turns text into arrays of integer term ids, for indexing and querying alike
+
+    Every distinct lowercase word seen while indexing is resolved to its term id once
+    (stop word check, length check and stemming) and remembered, so indexing a chunk is
+    one regex pass plus a dict lookup per word. Queries use the same resolution, but words
+    the corpus never contained are dropped instead of added.
+    """
+
+    def __init__(self, use_stemming: bool = False):
+        self.use_stemming = use_stemming
+        self.vocabulary: Dict[str, int] = {}  # term -> id
+        self.terms: List[str] = []  # id -> term
+        self._word_ids: Dict[str, int] = {}  # lowercase word -> term id or DROPPED
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _term(self, word: str) -> Optional[str]:
+        if len(word) < MIN_TERM_LENGTH or word in STOP_WORDS:
+            return None
+        return stem(word) if self.use_stemming else word
+
+    def _add_word(self, word: str) -> int:
+        term = self._term(word)
+        if term is None:
+            term_id = DROPPED
+        else:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.terms)
+                self.terms.append(term)
+        self._word_ids[word] = term_id
+        return term_id
+
+    def encode(self, text: str) -> array:
+        """Term ids of a document, adding its new terms to the vocabulary"""
+        words = WORD_PATTERN.findall(text.lower())
+        word_ids = self._word_ids
+        try:
+            return array("I", filter(DROPPED.__ne__, map(word_ids.__getitem__, words)))
+        except KeyError:
+            for word in words:
+                if word not in word_ids:
+                    self._add_word(word)
+            return array("I", filter(DROPPED.__ne__, map(word_ids.__getitem__, words)))
+
+    def encode_query(self, text: str) -> array:
+        """Term ids of a query, without the terms the vocabulary does not contain"""
+        word_ids = self._word_ids
+        vocabulary = self.vocabulary
+        ids = array("I")
+        for word in WORD_PATTERN.findall(text.lower()):
+            term_id = word_ids.get(word)
+            if term_id is None:
+                # Not in any document as written, but it may share a stem with a word that is
+                term = self._term(word)
+                term_id = vocabulary.get(term, DROPPED) if term is not None else DROPPED
+            if term_id != DROPPED:
+                ids.append(term_id)
+        return ids
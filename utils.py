@@ -1,212 +1,464 @@
 import os
-import re
 import json
 import base64
 import numpy as np
-from typing import List, Dict, Tuple, Optional
-from sentence_transformers import SentenceTransformer
+from typing import Iterator, List, Dict, Tuple, Optional
 import faiss
 import gc
-from dataclasses import dataclass
+import hashlib
+import time
+import threading
 import logging
+from corpus import compute_corpus_hash, iter_documents
+from corpus_artifact import CORPUS_DIR, load_corpus
+from cache import LRUCache, normalize_question
+from chunk_store import ChunkStore, DocumentChunk
+from chunker import MarkdownChunker
+from encoders import DEFAULT_ENCODER, ENCODER_BACKENDS, ONNX_MODEL_DIR, load_encoder
+from hybrid import FUSION_METHODS, RETRIEVAL_MODES, HybridRetriever
+from metrics import stage
+from vector_index import DEFAULT_INDEX_TYPE, INDEX_TYPES, build_index, configure_search, create_index, supports_remove
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
-class DocumentChunk:
-    """Represents a chunk of document with metadata"""
-    content: str
-    source: str
-    url: Optional[str] = None
-    title: Optional[str] = None
+MODEL_NAME = 'all-MiniLM-L6-v2'
+INDEX_DIR = "index_data"
+INDEX_FORMAT_VERSION = 7
+
+def compute_settings_hash(**params) -> str:
+    """Hash the build parameters that make a prebuilt index incompatible when changed"""
+    payload = json.dumps({"version": INDEX_FORMAT_VERSION, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _write_atomic(path: str, write):
+    """Write a file via a temporary path so readers mapping the old file are unaffected"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _write_json(path: str, data, **kwargs):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+
+def _write_npy(path: str, array: np.ndarray):
+    # Pass a file object, np.save appends .npy to bare paths without that suffix
+    with open(path, "wb") as f:
+        np.save(f, array)
 
 class TDSVirtualTA:
     """
     Memory-efficient TDS Virtual TA system using semantic search
     """
     
-    def __init__(self, chunk_size: int = 500, overlap: int = 50):
+    def __init__(self, chunk_size: int = 200, overlap: int = 20, index_dir: Optional[str] = INDEX_DIR,
+                 answer_cache_size: int = 1024, answer_cache_ttl: Optional[float] = 3600,
+                 embedding_cache_size: int = 4096, read_only: bool = False,
+                 index_type: str = DEFAULT_INDEX_TYPE, retrieval: str = "dense", fusion: str = "rrf",
+                 encoder: str = DEFAULT_ENCODER, onnx_dir: str = ONNX_MODEL_DIR, corpus_dir: Optional[str] = CORPUS_DIR,
+                 use_stemming: bool = False):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+        if encoder not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder {encoder!r}, expected one of {', '.join(ENCODER_BACKENDS)}")
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval!r}, expected one of {', '.join(RETRIEVAL_MODES)}")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method {fusion!r}, expected one of {', '.join(FUSION_METHODS)}")
+        # Chunk size and overlap are in estimated tokens, heading path included; the estimate errs
+        # high for WordPiece and 200 leaves headroom for rare words, so chunks fit the 256 token window
         self.chunk_size = chunk_size
         self.overlap = overlap
-        self.chunks: List[DocumentChunk] = []
+        self.chunker = MarkdownChunker(max_tokens=chunk_size, overlap_tokens=overlap)
+        self.index_dir = index_dir
+        # Prebuilt chunks from build_corpus.py, used instead of chunking when they match chunk_size/overlap
+        self.corpus_dir = corpus_dir
+        # Read-only instances serve a prebuilt index as-is, e.g. one of several workers mapping the same files
+        self.read_only = read_only
+        self.index_type = index_type
+        # "onnx" runs the int8 export from export_onnx.py instead of PyTorch
+        self.encoder = encoder
+        self.onnx_dir = onnx_dir
+        # "hybrid" fuses BM25 over the same chunk rows with the dense scores
+        self.retrieval = retrieval
+        self.fusion = fusion
+        self.use_stemming = use_stemming  # Of the BM25 terms, the dense side is unaffected
+        self.retriever: Optional[HybridRetriever] = None
+        self.chunks = ChunkStore()
+        self.chunk_ids = np.zeros(0, dtype='int64')  # Stable, ascending FAISS ids aligned with self.chunks
         self.embeddings = None
         self.index = None
-        self.model = None
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.documents: Dict[str, Dict] = {}  # doc_id -> {"fingerprint", "chunk_ids"}
+        self.next_chunk_id = 0
+        self.prebuilt_index_dir: Optional[str] = None
+        self._unsaved_changes = False
+        self.settings_hash = compute_settings_hash(model=MODEL_NAME, chunk_size=chunk_size, overlap=overlap,
+                                                   index_type=index_type, encoder=encoder)
+        self.answer_cache = LRUCache(answer_cache_size, ttl=answer_cache_ttl)
+        # Query embeddings only depend on the model, so they survive re-indexing
+        self.embedding_cache = LRUCache(embedding_cache_size)
+        self._swap_lock = threading.Lock()
+        self._reindex_lock = threading.Lock()
         
-        # Initialize the system
-        self._load_model()
-        self._load_and_process_documents()
-        self._build_search_index()
+        # Initialize the system, the model itself is only loaded once something needs encoding
+        if read_only:
+            if not (index_dir and self._load_prebuilt_index(index_dir)):
+                raise RuntimeError(f"Read-only mode needs a prebuilt index in {index_dir}, run build_index.py first")
+            self.last_reindex = None
+        else:
+            if not (index_dir and self._load_prebuilt_index(index_dir)):
+                self._init_empty_index()
+            # Only new or changed documents are chunked and encoded
+            self.last_reindex = self.reindex(save=False)
         
         # Clear memory after initialization
         gc.collect()
     
+    @property
+    def model(self):
+        """The sentence encoder, loaded on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._load_model()
+        return self._model
+    
     def _load_model(self):
         """Load the sentence transformer model"""
-        logger.info("Loading sentence transformer model...")
+        logger.info(f"Loading sentence transformer model ({self.encoder} backend)...")
         # Use a lightweight model to save memory
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self._model = load_encoder(self.encoder, MODEL_NAME, self.onnx_dir)
         logger.info("Model loaded successfully")
     
     def _chunk_text(self, text: str, source: str, url: Optional[str] = None, title: Optional[str] = None) -> List[DocumentChunk]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        sentences = re.split(r'[.!?]+', text)
-        current_chunk = ""
+        """Split a document into heading-aware chunks of at most chunk_size tokens"""
+        return self.chunker.chunk(text, source, url=url, title=title)
+    
+    def _init_empty_index(self):
+        """Create an empty ID-mapped FAISS index for the model's embedding dimension"""
+        dimension = self.model.get_sentence_embedding_dimension()
+        # Exact placeholder until the first reindex builds (and trains) the configured index type;
+        # asking for an empty ivf/ivfpq index would only warn that it falls back to an exact one
+        self.index = create_index("flat", dimension)
+        self.embeddings = np.zeros((0, dimension), dtype='float32')
+    
+    def _make_retriever(self, chunks: ChunkStore, embeddings: np.ndarray) -> Optional[HybridRetriever]:
+        """Build the keyword side of hybrid retrieval for a chunk table, None in dense mode"""
+        if self.retrieval != "hybrid":
+            return None
+        return HybridRetriever(chunks, embeddings, fusion=self.fusion, use_stemming=self.use_stemming)
+    
+    def _encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Encode texts as L2-normalized float32 rows, so inner product is cosine similarity"""
+        embeddings = self.model.encode(texts, normalize_embeddings=True, **kwargs)
+        return np.ascontiguousarray(embeddings, dtype='float32')
+    
+    def reindex(self, save: bool = True) -> Dict[str, int]:
+        """
+        Bring the index up to date with the documents on disk
+        
+        Only documents whose fingerprint changed are re-chunked and re-encoded;
+        their old vectors are removed from the index by id. Chunks come from the
+        build_corpus.py artifact when it is up to date, so nothing is chunked here.
+        
+        Args:
+            save: Persist the updated index to index_dir when something changed
+            
+        Returns:
+            Counts of added/removed documents and chunks
+        """
+        if self.read_only:
+            raise RuntimeError("Index is read-only, rebuild it with build_index.py and restart the workers")
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
+        with self._reindex_lock:
+            logger.info("Checking documents for changes...")
+            artifact = load_corpus(self.corpus_dir, self.chunk_size, self.overlap) if self.corpus_dir else None
+            if artifact:
+                artifact_chunks, artifact_documents = artifact
+                current = {doc_id: info["fingerprint"] for doc_id, info in artifact_documents.items()}
+                
+                def chunks_of(doc_id: str) -> List[DocumentChunk]:
+                    start, end = artifact_documents[doc_id]["rows"]
+                    return [artifact_chunks[row] for row in range(start, end)]
+            else:
+                current_docs = {doc.doc_id: doc for doc in iter_documents()}
+                current = {doc_id: doc.fingerprint for doc_id, doc in current_docs.items()}
                 
-            if len(current_chunk) + len(sentence) < self.chunk_size:
-                current_chunk += sentence + ". "
+                def chunks_of(doc_id: str) -> List[DocumentChunk]:
+                    doc = current_docs[doc_id]
+                    return self._chunk_text(doc.content, doc.source, url=doc.url, title=doc.title)
+            
+            changed = [doc_id for doc_id, fingerprint in current.items()
+                       if self.documents.get(doc_id, {}).get("fingerprint") != fingerprint]
+            stale_doc_ids = [doc_id for doc_id, info in self.documents.items()
+                             if current.get(doc_id) != info["fingerprint"]]
+            stats = {
+                "added_documents": sum(1 for doc_id in changed if doc_id not in self.documents),
+                "updated_documents": sum(1 for doc_id in changed if doc_id in self.documents),
+                "removed_documents": sum(1 for doc_id in stale_doc_ids if doc_id not in current),
+                "added_chunks": 0,
+                "removed_chunks": 0,
+                "total_chunks": len(self.chunks),
+            }
+            if not changed and not stale_doc_ids:
+                logger.info(f"Search index is up to date with {len(self.chunks)} documents")
+                if save and self.index_dir and self._unsaved_changes:
+                    self.save_index(self.index_dir)
+                return stats
+            
+            # Chunk the new/changed documents and give them fresh ids
+            documents = {doc_id: info for doc_id, info in self.documents.items() if doc_id not in stale_doc_ids}
+            new_chunks: List[DocumentChunk] = []
+            new_ids: List[int] = []
+            next_chunk_id = self.next_chunk_id
+            for doc_id in changed:
+                doc_chunks = chunks_of(doc_id)
+                doc_ids = list(range(next_chunk_id, next_chunk_id + len(doc_chunks)))
+                next_chunk_id += len(doc_chunks)
+                new_chunks.extend(doc_chunks)
+                new_ids.extend(doc_ids)
+                documents[doc_id] = {"fingerprint": current[doc_id], "chunk_ids": doc_ids}
+            
+            removed_ids = np.array(
+                [chunk_id for doc_id in stale_doc_ids for chunk_id in self.documents[doc_id]["chunk_ids"]],
+                dtype='int64'
+            )
+            logger.info(f"Re-indexing {len(changed)} documents ({len(new_chunks)} chunks), removing {len(removed_ids)} chunks")
+            
+            if new_chunks:
+                new_embeddings = self._encode([chunk.content for chunk in new_chunks], show_progress_bar=True)
             else:
-                if current_chunk:
-                    chunks.append(DocumentChunk(
-                        content=current_chunk.strip(),
-                        source=source,
-                        url=url,
-                        title=title
-                    ))
-                current_chunk = sentence + ". "
+                new_embeddings = np.zeros((0, self.embeddings.shape[1]), dtype='float32')
+            new_ids = np.array(new_ids, dtype='int64')
+            
+            keep = ~np.isin(self.chunk_ids, removed_ids)
+            chunks = self.chunks.select(np.flatnonzero(keep))
+            chunks.extend(new_chunks)
+            chunk_ids = np.concatenate([self.chunk_ids[keep], new_ids])
+            embeddings = np.vstack([self.embeddings[keep], new_embeddings])
+            
+            if self.index.ntotal == 0 or (len(removed_ids) and not supports_remove(self.index)):
+                # First build (IVF/PQ train on the whole corpus) or an HNSW graph that cannot drop
+                # vectors: rebuild from the stored embeddings, nothing is re-encoded
+                index = build_index(self.index_type, embeddings, chunk_ids)
+            else:
+                # Update an owned copy so searches keep using the current index. clone_index would
+                # share the read-only memory-mapped codes of a prebuilt index, a serialize round trip does not.
+                index = faiss.deserialize_index(faiss.serialize_index(self.index))
+                if len(removed_ids):
+                    index.remove_ids(removed_ids)
+                if len(new_ids):
+                    index.add_with_ids(new_embeddings, new_ids)
+            
+            retriever = self._make_retriever(chunks, embeddings)
+            
+            with self._swap_lock:
+                self.index = index
+                self.retriever = retriever
+                self.chunks = chunks
+                self.chunk_ids = chunk_ids
+                self.embeddings = embeddings
+                self.documents = documents
+                self.next_chunk_id = next_chunk_id
+            
+            self._unsaved_changes = True
+            self.answer_cache.clear()
+            stats["added_chunks"] = len(new_ids)
+            stats["removed_chunks"] = len(removed_ids)
+            stats["total_chunks"] = len(chunks)
+            logger.info(f"Search index updated with {len(chunks)} documents")
+            
+            if save and self.index_dir:
+                self.save_index(self.index_dir)
+            return stats
+    
+    def save_index(self, index_dir: str = INDEX_DIR):
+        """Write the chunk table, embedding matrix and FAISS index to disk"""
+        if self.index is None:
+            raise ValueError("No search index to save")
         
-        # Add the last chunk
-        if current_chunk:
-            chunks.append(DocumentChunk(
-                content=current_chunk.strip(),
-                source=source,
-                url=url,
-                title=title
-            ))
+        os.makedirs(index_dir, exist_ok=True)
+        manifest_path = os.path.join(index_dir, "manifest.json")
         
-        return chunks
-    
-    def _extract_links_from_text(self, text: str) -> List[Dict[str, str]]:
-        """Extract markdown links from text"""
-        pattern = r'\[([^\]]+)\]\((https?://[^\)]+)\)'
-        matches = re.findall(pattern, text)
-        return [{"text": text, "url": url} for text, url in matches]
-    
-    def _load_markdown_file(self, filepath: str) -> str:
-        """Load markdown file with error handling"""
-        if not os.path.exists(filepath):
-            logger.warning(f"File not found: {filepath}")
-            return ""
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading {filepath}: {e}")
-            return ""
-    
-    def _load_and_process_documents(self):
-        """Load and chunk all documents"""
-        logger.info("Loading and processing documents...")
+        # Remove the manifest first so a half-written index is never loaded
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
         
-        # Load course content
-        course_content = self._load_markdown_file("course.md")
-        if course_content:
-            course_chunks = self._chunk_text(course_content, "course")
-            self.chunks.extend(course_chunks)
-            logger.info(f"Added {len(course_chunks)} course chunks")
+        self.chunks.save(index_dir)
+        _write_atomic(os.path.join(index_dir, "documents.json"),
+                      lambda path: _write_json(path, self.documents))
+        _write_atomic(os.path.join(index_dir, "chunk_ids.npy"),
+                      lambda path: _write_npy(path, self.chunk_ids))
+        _write_atomic(os.path.join(index_dir, "embeddings.npy"),
+                      lambda path: _write_npy(path, np.ascontiguousarray(self.embeddings, dtype='float32')))
+        _write_atomic(os.path.join(index_dir, "faiss.index"),
+                      lambda path: faiss.write_index(self.index, path))
         
-        # Load discourse content
-        discourse_content = self._load_markdown_file("discourse.md")
-        if discourse_content:
-            discourse_chunks = self._chunk_text(discourse_content, "discourse")
-            self.chunks.extend(discourse_chunks)
-            logger.info(f"Added {len(discourse_chunks)} discourse chunks")
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "settings_hash": self.settings_hash,
+            "corpus_hash": compute_corpus_hash({doc_id: info["fingerprint"] for doc_id, info in self.documents.items()}),
+            "model": MODEL_NAME,
+            "chunk_size": self.chunk_size,
+            "overlap": self.overlap,
+            "index_type": self.index_type,
+            "encoder": self.encoder,
+            "num_documents": len(self.documents),
+            "num_chunks": len(self.chunks),
+            "next_chunk_id": self.next_chunk_id,
+            "dimension": int(self.embeddings.shape[1]),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        _write_atomic(manifest_path, lambda path: _write_json(path, manifest, indent=2))
+        
+        self._unsaved_changes = False
+        logger.info(f"Search index saved to {index_dir} ({len(self.chunks)} chunks)")
+    
+    def _load_prebuilt_index(self, index_dir: str) -> bool:
+        """Memory-map a prebuilt index if it was built with the current settings, returns False otherwise"""
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            logger.info(f"No prebuilt index found in {index_dir}")
+            return False
         
-        # Load discourse posts JSON for better link extraction
         try:
-            if os.path.exists("discourse_posts.json"):
-                with open("discourse_posts.json", "r", encoding="utf-8") as f:
-                    posts_data = json.load(f)
-                
-                # Process posts and add to chunks
-                for post in posts_data[:1000]:  # Limit to first 1000 posts to save memory
-                    if isinstance(post, dict) and 'content' in post:
-                        post_chunks = self._chunk_text(
-                            post['content'], 
-                            "discourse_post",
-                            url=post.get('url'),
-                            title=post.get('title')
-                        )
-                        self.chunks.extend(post_chunks)
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("settings_hash") != self.settings_hash:
+                logger.warning(f"Prebuilt index in {index_dir} uses different settings, rebuilding in memory")
+                return False
+            
+            # Everything large is memory-mapped so worker processes share it through the page cache
+            chunks = ChunkStore.load(index_dir)
+            with open(os.path.join(index_dir, "documents.json"), "r", encoding="utf-8") as f:
+                documents = json.load(f)
+            chunk_ids = np.load(os.path.join(index_dir, "chunk_ids.npy"), mmap_mode='r')
+            embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode='r')
+            # Map the flat codes straight from the file instead of copying them onto the heap
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            index = faiss.read_index(os.path.join(index_dir, "faiss.index"), mmap_flag)
+            configure_search(index)
+            
+            if not (len(chunks) == len(chunk_ids) == embeddings.shape[0] == index.ntotal):
+                logger.warning(f"Prebuilt index in {index_dir} is inconsistent, rebuilding in memory")
+                return False
         except Exception as e:
-            logger.error(f"Error loading discourse posts: {e}")
+            logger.error(f"Error loading prebuilt index from {index_dir}: {e}")
+            return False
         
-        logger.info(f"Total chunks created: {len(self.chunks)}")
+        self.chunks = chunks
+        self.chunk_ids = chunk_ids
+        self.embeddings = embeddings
+        self.index = index
+        self.retriever = self._make_retriever(chunks, embeddings)
+        self.documents = documents
+        self.next_chunk_id = int(manifest.get("next_chunk_id", int(chunk_ids.max(initial=-1)) + 1))
+        self.prebuilt_index_dir = index_dir
+        logger.info(f"Loaded prebuilt search index with {len(self.chunks)} documents from {index_dir}")
+        return True
     
-    def _build_search_index(self):
-        """Build FAISS index for semantic search"""
-        if not self.chunks:
-            logger.warning("No chunks available for indexing")
-            return
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode queries as a (len(queries), dimension) float32 matrix in one model call, reusing cached embeddings"""
+        keys = [normalize_question(query) for query in queries]
+        cached = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
         
-        logger.info("Building search index...")
+        if missing:
+            # Encode each distinct uncached query once
+            to_encode: Dict[str, str] = {}
+            for i in missing:
+                to_encode.setdefault(keys[i], queries[i])
+            encoded = self._encode(list(to_encode.values()))
+            by_key = dict(zip(to_encode, encoded))
+            for key, embedding in by_key.items():
+                self.embedding_cache.set(key, embedding)
+            for i in missing:
+                cached[i] = by_key[keys[i]]
         
-        # Create embeddings
-        texts = [chunk.content for chunk in self.chunks]
-        self.embeddings = self.model.encode(texts, show_progress_bar=True)
+        return np.ascontiguousarray(np.vstack(cached), dtype='float32')
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit/miss counters of the answer and query embedding caches"""
+        return {
+            "answers": self.answer_cache.stats(),
+            "query_embeddings": self.embedding_cache.stats(),
+        }
+    
+    @staticmethod
+    def _rows_for_ids(chunk_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Map FAISS ids to chunk rows (-1 when missing); chunk ids are kept in ascending order"""
+        if not len(chunk_ids):
+            return np.full(ids.shape, -1)
+        rows = np.minimum(np.searchsorted(chunk_ids, ids), len(chunk_ids) - 1)
+        return np.where(chunk_ids[rows] == ids, rows, -1)
+    
+    def _dense_search(self, index, chunk_ids: np.ndarray, query_embeddings: np.ndarray,
+                      top_k: int) -> List[List[Tuple[int, float]]]:
+        """Search the vector index, returning (chunk row, cosine similarity) pairs per query"""
+        scores, ids = index.search(query_embeddings, top_k)
+        return [
+            [(int(row), float(score)) for score, row in zip(query_scores, rows) if row >= 0]
+            for query_scores, rows in zip(scores, self._rows_for_ids(chunk_ids, ids))
+        ]
+    
+    def _search_similar_chunks_batch(self, queries: List[str], top_k: int = 5) -> List[List[Tuple[DocumentChunk, float]]]:
+        """
+        Search for similar chunks of several queries with one encode call
+
+        In dense mode that is one vector index search for all of them; in hybrid mode BM25 runs
+        per query and the dense rescoring is one matrix product for the whole batch.
+        """
+        with self._swap_lock:
+            index, chunks, chunk_ids, retriever = self.index, self.chunks, self.chunk_ids, self.retriever
+        if index is None or not len(chunks) or not queries:
+            return [[] for _ in queries]
         
-        # Build FAISS index
-        dimension = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        self.index.add(self.embeddings.astype('float32'))
+        with stage("encode"):
+            query_embeddings = self._encode_queries(queries)
+        if retriever is None:
+            with stage("search"):
+                batch_hits = self._dense_search(index, chunk_ids, query_embeddings, top_k)
+        else:
+            # Keyword candidates rescored densely, the vector index is only searched when they fall short
+            batch_hits = retriever.search_batch(
+                queries, query_embeddings, top_k,
+                dense_search=lambda embeddings, k: self._dense_search(index, chunk_ids, embeddings, k)
+            )
         
-        logger.info(f"Search index built with {len(self.chunks)} documents")
+        with stage("scoring"):
+            return [[(chunks[row], score) for row, score in hits] for hits in batch_hits]
     
     def _search_similar_chunks(self, query: str, top_k: int = 5) -> List[Tuple[DocumentChunk, float]]:
         """Search for similar chunks using semantic search"""
-        if not self.index or not self.chunks:
-            return []
-        
-        # Encode query
-        query_embedding = self.model.encode([query])
-        
-        # Search
-        scores, indices = self.index.search(query_embedding.astype('float32'), top_k)
-        
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.chunks):
-                results.append((self.chunks[idx], float(score)))
-        
-        return results
+        return self._search_similar_chunks_batch([query], top_k)[0]
     
     def _extract_relevant_links(self, chunks: List[Tuple[DocumentChunk, float]]) -> List[Dict[str, str]]:
-        """Extract relevant links from chunks"""
+        """Collect up to 5 distinct links from the chunks' precomputed link tables, best chunk first"""
         links = []
         seen_urls = set()
         
         for chunk, score in chunks:
-            # Extract links from chunk content
-            chunk_links = self._extract_links_from_text(chunk.content)
-            
-            # Add chunk URL if available
-            if chunk.url and chunk.url not in seen_urls:
-                links.append({
-                    "url": chunk.url,
-                    "text": chunk.title or f"Relevant content from {chunk.source}"
-                })
-                seen_urls.add(chunk.url)
-            
-            # Add extracted links
-            for link in chunk_links:
-                if link["url"] not in seen_urls:
-                    links.append(link)
-                    seen_urls.add(link["url"])
+            for url, text in chunk.links or ():
+                if url not in seen_urls:
+                    links.append({"url": url, "text": text})
+                    seen_urls.add(url)
+                    if len(links) == 5:  # Limit to top 5 links
+                        return links
         
-        return links[:5]  # Limit to top 5 links
+        return links
     
     def _generate_answer(self, query: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> str:
         """Generate answer based on relevant chunks"""
+        return "".join(self._iter_answer(query, relevant_chunks))
+    
+    def _iter_answer(self, query: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> Iterator[str]:
+        """Generate the answer piece by piece: the introduction, then each context chunk as it is added"""
         if not relevant_chunks:
-            return "I couldn't find specific information to answer your question. Please try rephrasing or ask about a different topic related to the TDS course."
+            yield "I couldn't find specific information to answer your question. Please try rephrasing or ask about a different topic related to the TDS course."
+            return
         
         # Combine top chunks for context
         context_parts = []
@@ -215,19 +467,21 @@ class TDSVirtualTA:
                 context_parts.append(chunk.content)
         
         if not context_parts:
-            return "I found some related information, but it may not directly answer your question. Please try rephrasing your question."
-        
-        # Create a comprehensive answer
-        context = "\n\n".join(context_parts)
+            yield "I found some related information, but it may not directly answer your question. Please try rephrasing your question."
+            return
         
         # Simple answer generation based on context
-        answer = f"Based on the course content and discourse posts, here's what I found:\n\n"
-        answer += context[:1000]  # Limit answer length
-        
-        if len(context) > 1000:
-            answer += "\n\n[Content truncated for brevity]"
-        
-        return answer
+        yield f"Based on the course content and discourse posts, here's what I found:\n\n"
+        length = 0
+        for i, part in enumerate(context_parts):
+            piece = "\n\n" + part if i else part
+            if length + len(piece) > 1000:  # Limit answer length
+                if length < 1000:
+                    yield piece[:1000 - length]
+                yield "\n\n[Content truncated for brevity]"
+                return
+            yield piece
+            length += len(piece)
     
     def answer_question(self, question: str, image_base64: Optional[str] = None) -> Tuple[str, List[Dict[str, str]]]:
         """
@@ -246,21 +500,115 @@ class TDSVirtualTA:
             if image_base64:
                 logger.info("Image provided but not processed in this version")
             
+            # Repeated questions are answered from the cache (questions with images are never cached)
+            cache_key = None if image_base64 else normalize_question(question)
+            if cache_key is not None:
+                cached = self.answer_cache.get(cache_key)
+                if cached is not None:
+                    answer, links = cached
+                    return answer, list(links)
+            
             # Search for relevant chunks
             relevant_chunks = self._search_similar_chunks(question)
             
             # Generate answer
-            answer = self._generate_answer(question, relevant_chunks)
+            with stage("answer"):
+                answer = self._generate_answer(question, relevant_chunks)
             
             # Extract relevant links
-            links = self._extract_relevant_links(relevant_chunks)
+            with stage("links"):
+                links = self._extract_relevant_links(relevant_chunks)
             
+            if cache_key is not None:
+                self.answer_cache.set(cache_key, (answer, list(links)))
             return answer, links
             
         except Exception as e:
             logger.error(f"Error answering question: {e}")
             return "I encountered an error while processing your question. Please try again.", []
 
+    def stream_answer(self, question: str, image_base64: Optional[str] = None) -> Tuple[List[Dict[str, str]], Iterator[str]]:
+        """
+        Answer a student question for a streaming response
+        
+        Retrieval and the links are done before this returns; the answer text is produced
+        piece by piece by the returned iterator, and cached once it has been read to the end.
+        
+        Args:
+            question: The student's question
+            image_base64: Optional base64 encoded image
+            
+        Returns:
+            Tuple of (links, iterator over the pieces of the answer)
+        """
+        try:
+            if image_base64:
+                logger.info("Image provided but not processed in this version")
+            
+            cache_key = None if image_base64 else normalize_question(question)
+            if cache_key is not None:
+                cached = self.answer_cache.get(cache_key)
+                if cached is not None:
+                    answer, links = cached
+                    return list(links), iter([answer])
+            
+            relevant_chunks = self._search_similar_chunks(question)
+            with stage("links"):
+                links = self._extract_relevant_links(relevant_chunks)
+            
+        except Exception as e:
+            logger.error(f"Error answering question: {e}")
+            return [], iter(["I encountered an error while processing your question. Please try again."])
+        
+        return links, self._stream_and_cache(question, relevant_chunks, links, cache_key)
+    
+    def _stream_and_cache(self, question: str, relevant_chunks: List[Tuple[DocumentChunk, float]],
+                          links: List[Dict[str, str]], cache_key: Optional[str]) -> Iterator[str]:
+        pieces = []
+        for piece in self._iter_answer(question, relevant_chunks):
+            pieces.append(piece)
+            yield piece
+        if cache_key is not None:
+            self.answer_cache.set(cache_key, ("".join(pieces), list(links)))
+    
+    def answer_questions(self, questions: List[str]) -> List[Tuple[str, List[Dict[str, str]]]]:
+        """
+        Answer several questions at once, encoding and searching all uncached ones in a single batch
+        
+        Args:
+            questions: The student questions
+            
+        Returns:
+            List of (answer, links) tuples in the same order as questions
+        """
+        try:
+            results: List[Optional[Tuple[str, List[Dict[str, str]]]]] = [None] * len(questions)
+            pending = []
+            for i, question in enumerate(questions):
+                cached = self.answer_cache.get(normalize_question(question))
+                if cached is not None:
+                    answer, links = cached
+                    results[i] = (answer, list(links))
+                else:
+                    pending.append(i)
+            
+            if pending:
+                batch_chunks = self._search_similar_chunks_batch([questions[i] for i in pending])
+                for i, relevant_chunks in zip(pending, batch_chunks):
+                    with stage("answer"):
+                        answer = self._generate_answer(questions[i], relevant_chunks)
+                    with stage("links"):
+                        links = self._extract_relevant_links(relevant_chunks)
+                    self.answer_cache.set(normalize_question(questions[i]), (answer, list(links)))
+                    results[i] = (answer, links)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error answering questions: {e}")
+            return [("I encountered an error while processing your question. Please try again.", [])
+                    for _ in questions]
+
 def load_documents() -> List[Dict[str, str]]:
     """Legacy function for backward compatibility"""
     ta = TDSVirtualTA()
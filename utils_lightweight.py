@@ -1,254 +1,124 @@
 import os
-import re
 import json
 import base64
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+from typing import Iterator, List, Dict, Tuple, Optional
 import logging
-from collections import Counter
-import math
+from cache import LRUCache, normalize_question
+from bm25 import BM25Index
+from chunk_store import ChunkStore, DocumentChunk
+from chunker import MarkdownChunker
+from corpus import iter_documents
+from corpus_artifact import CORPUS_DIR, load_corpus
+from metrics import stage
+from tokenizer import Tokenizer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
-class DocumentChunk:
-    """Represents a chunk of document with metadata"""
-    content: str
-    source: str
-    url: Optional[str] = None
-    title: Optional[str] = None
-    keywords: List[str] = None
-
 class LightweightTDSVirtualTA:
     """
-    Ultra-lightweight TDS Virtual TA system using keyword-based search
+    Ultra-lightweight TDS Virtual TA system using BM25 keyword search
     Memory usage: ~50-100MB
     """
     
-    def __init__(self, chunk_size: int = 300):
-        self.chunk_size = chunk_size
-        self.chunks: List[DocumentChunk] = []
-        self.keyword_index: Dict[str, List[int]] = {}
+    def __init__(self, chunk_size: int = 64, answer_cache_size: int = 1024, answer_cache_ttl: Optional[float] = 3600,
+                 corpus_dir: Optional[str] = CORPUS_DIR, use_stemming: bool = False):
+        self.chunk_size = chunk_size  # In tokens
+        self.corpus_dir = corpus_dir  # Prebuilt chunks from build_corpus.py
+        self.chunker = MarkdownChunker(max_tokens=chunk_size, overlap_tokens=chunk_size // 10)
+        # Columnar store, chunks are only materialized as DocumentChunk for search results
+        self.chunks = ChunkStore()
+        # Chunks and queries are indexed and searched as integer term ids from one vocabulary
+        self.tokenizer = Tokenizer(use_stemming=use_stemming)
+        self.bm25 = BM25Index()
+        self.answer_cache = LRUCache(answer_cache_size, ttl=answer_cache_ttl)
         
         # Initialize the system
         self._load_and_process_documents()
-        self._build_keyword_index()
+        self._build_bm25_index()
         
         logger.info(f"Lightweight TDS Virtual TA initialized with {len(self.chunks)} chunks")
     
-    def _extract_keywords(self, text: str) -> List[str]:
-        """Extract important keywords from text"""
-        # Remove markdown and special characters
-        clean_text = re.sub(r'[^\w\s]', ' ', text.lower())
-        
-        # Split into words and filter
-        words = clean_text.split()
-        
-        # Remove common stop words
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-            'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
-            'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'
-        }
-        
-        keywords = [word for word in words if len(word) > 2 and word not in stop_words]
-        
-        # Count frequency and return top keywords
-        word_counts = Counter(keywords)
-        return [word for word, count in word_counts.most_common(10)]
-    
     def _chunk_text(self, text: str, source: str, url: Optional[str] = None, title: Optional[str] = None) -> List[DocumentChunk]:
-        """Split text into chunks"""
-        chunks = []
-        sentences = re.split(r'[.!?]+', text)
-        current_chunk = ""
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            if len(current_chunk) + len(sentence) < self.chunk_size:
-                current_chunk += sentence + ". "
-            else:
-                if current_chunk:
-                    keywords = self._extract_keywords(current_chunk)
-                    chunks.append(DocumentChunk(
-                        content=current_chunk.strip(),
-                        source=source,
-                        url=url,
-                        title=title,
-                        keywords=keywords
-                    ))
-                current_chunk = sentence + ". "
-        
-        # Add the last chunk
-        if current_chunk:
-            keywords = self._extract_keywords(current_chunk)
-            chunks.append(DocumentChunk(
-                content=current_chunk.strip(),
-                source=source,
-                url=url,
-                title=title,
-                keywords=keywords
-            ))
-        
-        return chunks
-    
-    def _extract_links_from_text(self, text: str) -> List[Dict[str, str]]:
-        """Extract markdown links from text"""
-        pattern = r'\[([^\]]+)\]\((https?://[^\)]+)\)'
-        matches = re.findall(pattern, text)
-        return [{"text": text, "url": url} for text, url in matches]
-    
-    def _load_markdown_file(self, filepath: str) -> str:
-        """Load markdown file with error handling"""
-        if not os.path.exists(filepath):
-            logger.warning(f"File not found: {filepath}")
-            return ""
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading {filepath}: {e}")
-            return ""
+        """Split a document into heading-aware chunks of at most chunk_size tokens"""
+        return self.chunker.chunk(text, source, url=url, title=title)
     
     def _load_and_process_documents(self):
-        """Load and chunk all documents"""
-        logger.info("Loading and processing documents...")
+        """Load the prebuilt chunks, or stream every course page and discourse post through the chunker"""
+        artifact = load_corpus(self.corpus_dir, self.chunk_size, self.chunk_size // 10) if self.corpus_dir else None
+        if artifact:
+            self.chunks = artifact[0]
+            return
         
-        # Load course content
-        course_content = self._load_markdown_file("course.md")
-        if course_content:
-            course_chunks = self._chunk_text(course_content, "course")
-            self.chunks.extend(course_chunks)
-            logger.info(f"Added {len(course_chunks)} course chunks")
+        logger.info("Loading and processing documents...")
         
-        # Load discourse content
-        discourse_content = self._load_markdown_file("discourse.md")
-        if discourse_content:
-            discourse_chunks = self._chunk_text(discourse_content, "discourse")
-            self.chunks.extend(discourse_chunks)
-            logger.info(f"Added {len(discourse_chunks)} discourse chunks")
-        
-        # Load limited discourse posts for memory efficiency
-        try:
-            if os.path.exists("discourse_posts.json"):
-                with open("discourse_posts.json", "r", encoding="utf-8") as f:
-                    posts_data = json.load(f)
-                
-                # Process only first 500 posts to save memory
-                for post in posts_data[:500]:
-                    if isinstance(post, dict) and 'content' in post:
-                        post_chunks = self._chunk_text(
-                            post['content'], 
-                            "discourse_post",
-                            url=post.get('url'),
-                            title=post.get('title')
-                        )
-                        self.chunks.extend(post_chunks)
-        except Exception as e:
-            logger.error(f"Error loading discourse posts: {e}")
+        chunk_counts: Dict[str, int] = {}
+        for doc in iter_documents():
+            doc_chunks = self._chunk_text(doc.content, doc.source, url=doc.url, title=doc.title)
+            self.chunks.extend(doc_chunks)
+            chunk_counts[doc.source] = chunk_counts.get(doc.source, 0) + len(doc_chunks)
         
+        for source, count in chunk_counts.items():
+            logger.info(f"Added {count} {source} chunks")
         logger.info(f"Total chunks created: {len(self.chunks)}")
     
-    def _build_keyword_index(self):
-        """Build keyword index for fast search"""
-        logger.info("Building keyword index...")
-        
-        for i, chunk in enumerate(self.chunks):
-            if chunk.keywords:
-                for keyword in chunk.keywords:
-                    if keyword not in self.keyword_index:
-                        self.keyword_index[keyword] = []
-                    self.keyword_index[keyword].append(i)
-        
-        logger.info(f"Keyword index built with {len(self.keyword_index)} keywords")
-    
-    def _calculate_similarity(self, query: str, chunk: DocumentChunk) -> float:
-        """Calculate similarity between query and chunk using TF-IDF-like scoring"""
-        query_words = set(re.findall(r'\w+', query.lower()))
-        chunk_words = set(chunk.keywords) if chunk.keywords else set()
-        
-        if not query_words or not chunk_words:
-            return 0.0
-        
-        # Calculate intersection
-        intersection = query_words.intersection(chunk_words)
-        
-        if not intersection:
-            return 0.0
-        
-        # Simple similarity score
-        similarity = len(intersection) / max(len(query_words), len(chunk_words))
+    def _build_bm25_index(self):
+        """Build the BM25 inverted index over all chunks"""
+        logger.info("Building BM25 index...")
         
-        # Boost score for exact matches
-        for word in query_words:
-            if word in chunk.content.lower():
-                similarity += 0.1
+        for row in range(len(self.chunks)):
+            self.bm25.add(self.tokenizer.encode(self.chunks.text(row)))
+        self.bm25.finalize()
         
-        return min(similarity, 1.0)
+        logger.info(f"BM25 index built with {self.bm25.num_terms} terms")
     
     def _search_similar_chunks(self, query: str, top_k: int = 5) -> List[Tuple[DocumentChunk, float]]:
-        """Search for similar chunks using keyword matching"""
-        if not self.chunks:
+        """Search for similar chunks using BM25"""
+        if not len(self.chunks):
             return []
         
-        # Get query keywords
-        query_keywords = self._extract_keywords(query)
-        
-        # Find chunks that contain query keywords
-        candidate_chunks = set()
-        for keyword in query_keywords:
-            if keyword in self.keyword_index:
-                candidate_chunks.update(self.keyword_index[keyword])
-        
-        # Calculate similarity scores
-        chunk_scores = []
-        for chunk_idx in candidate_chunks:
-            if chunk_idx < len(self.chunks):
-                chunk = self.chunks[chunk_idx]
-                score = self._calculate_similarity(query, chunk)
+        with stage("search"):
+            query_ids = self.tokenizer.encode_query(query)
+            max_score = self.bm25.max_score(query_ids)
+            if not max_score:
+                return []
+            hits = self.bm25.search(query_ids, top_k)
+        
+        with stage("scoring"):
+            # Scale scores to 0-1 by the best score any chunk could get for this query
+            chunk_scores = []
+            for chunk_idx, score in hits:
+                score /= max_score
                 if score > 0.1:  # Only include relevant chunks
-                    chunk_scores.append((chunk, score))
+                    chunk_scores.append((self.chunks[chunk_idx], score))
         
-        # Sort by score and return top k
-        chunk_scores.sort(key=lambda x: x[1], reverse=True)
-        return chunk_scores[:top_k]
+        return chunk_scores
     
     def _extract_relevant_links(self, chunks: List[Tuple[DocumentChunk, float]]) -> List[Dict[str, str]]:
-        """Extract relevant links from chunks"""
+        """Collect up to 5 distinct links from the chunks' precomputed link tables, best chunk first"""
         links = []
         seen_urls = set()
         
         for chunk, score in chunks:
-            # Extract links from chunk content
-            chunk_links = self._extract_links_from_text(chunk.content)
-            
-            # Add chunk URL if available
-            if chunk.url and chunk.url not in seen_urls:
-                links.append({
-                    "url": chunk.url,
-                    "text": chunk.title or f"Relevant content from {chunk.source}"
-                })
-                seen_urls.add(chunk.url)
-            
-            # Add extracted links
-            for link in chunk_links:
-                if link["url"] not in seen_urls:
-                    links.append(link)
-                    seen_urls.add(link["url"])
-        
-        return links[:5]  # Limit to top 5 links
+            for url, text in chunk.links or ():
+                if url not in seen_urls:
+                    links.append({"url": url, "text": text})
+                    seen_urls.add(url)
+                    if len(links) == 5:  # Limit to top 5 links
+                        return links
+        
+        return links
     
     def _generate_answer(self, query: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> str:
         """Generate answer based on relevant chunks"""
+        return "".join(self._iter_answer(query, relevant_chunks))
+    
+    def _iter_answer(self, query: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> Iterator[str]:
+        """Generate the answer piece by piece: the introduction, then each context chunk as it is added"""
         if not relevant_chunks:
-            return "I couldn't find specific information to answer your question. Please try rephrasing or ask about a different topic related to the TDS course."
+            yield "I couldn't find specific information to answer your question. Please try rephrasing or ask about a different topic related to the TDS course."
+            return
         
         # Combine top chunks for context
         context_parts = []
@@ -257,19 +127,25 @@ class LightweightTDSVirtualTA:
                 context_parts.append(chunk.content)
         
         if not context_parts:
-            return "I found some related information, but it may not directly answer your question. Please try rephrasing your question."
-        
-        # Create a comprehensive answer
-        context = "\n\n".join(context_parts)
+            yield "I found some related information, but it may not directly answer your question. Please try rephrasing your question."
+            return
         
         # Simple answer generation based on context
-        answer = f"Based on the course content and discourse posts, here's what I found:\n\n"
-        answer += context[:800]  # Limit answer length
-        
-        if len(context) > 800:
-            answer += "\n\n[Content truncated for brevity]"
-        
-        return answer
+        yield f"Based on the course content and discourse posts, here's what I found:\n\n"
+        length = 0
+        for i, part in enumerate(context_parts):
+            piece = "\n\n" + part if i else part
+            if length + len(piece) > 800:  # Limit answer length
+                if length < 800:
+                    yield piece[:800 - length]
+                yield "\n\n[Content truncated for brevity]"
+                return
+            yield piece
+            length += len(piece)
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit/miss counters of the answer cache"""
+        return {"answers": self.answer_cache.stats()}
     
     def answer_question(self, question: str, image_base64: Optional[str] = None) -> Tuple[str, List[Dict[str, str]]]:
         """
@@ -287,20 +163,90 @@ class LightweightTDSVirtualTA:
             if image_base64:
                 logger.info("Image provided but not processed in this version")
             
+            # Repeated questions are answered from the cache (questions with images are never cached)
+            cache_key = None if image_base64 else normalize_question(question)
+            if cache_key is not None:
+                cached = self.answer_cache.get(cache_key)
+                if cached is not None:
+                    answer, links = cached
+                    return answer, list(links)
+            
             # Search for relevant chunks
             relevant_chunks = self._search_similar_chunks(question)
             
             # Generate answer
-            answer = self._generate_answer(question, relevant_chunks)
+            with stage("answer"):
+                answer = self._generate_answer(question, relevant_chunks)
             
             # Extract relevant links
-            links = self._extract_relevant_links(relevant_chunks)
+            with stage("links"):
+                links = self._extract_relevant_links(relevant_chunks)
             
+            if cache_key is not None:
+                self.answer_cache.set(cache_key, (answer, list(links)))
             return answer, links
             
         except Exception as e:
             logger.error(f"Error answering question: {e}")
             return "I encountered an error while processing your question. Please try again.", []
+    
+    def answer_questions(self, questions: List[str]) -> List[Tuple[str, List[Dict[str, str]]]]:
+        """
+        Answer several questions, with the same contract as TDSVirtualTA.answer_questions
+        
+        BM25 has nothing to share between queries, so each question is searched on its own.
+        
+        Args:
+            questions: The student questions
+            
+        Returns:
+            List of (answer, links) tuples in the same order as questions
+        """
+        return [self.answer_question(question) for question in questions]
+    
+    def stream_answer(self, question: str, image_base64: Optional[str] = None) -> Tuple[List[Dict[str, str]], Iterator[str]]:
+        """
+        Answer a student question for a streaming response
+        
+        Retrieval and the links are done before this returns; the answer text is produced
+        piece by piece by the returned iterator, and cached once it has been read to the end.
+        
+        Args:
+            question: The student's question
+            image_base64: Optional base64 encoded image
+            
+        Returns:
+            Tuple of (links, iterator over the pieces of the answer)
+        """
+        try:
+            if image_base64:
+                logger.info("Image provided but not processed in this version")
+            
+            cache_key = None if image_base64 else normalize_question(question)
+            if cache_key is not None:
+                cached = self.answer_cache.get(cache_key)
+                if cached is not None:
+                    answer, links = cached
+                    return list(links), iter([answer])
+            
+            relevant_chunks = self._search_similar_chunks(question)
+            with stage("links"):
+                links = self._extract_relevant_links(relevant_chunks)
+            
+        except Exception as e:
+            logger.error(f"Error answering question: {e}")
+            return [], iter(["I encountered an error while processing your question. Please try again."])
+        
+        return links, self._stream_and_cache(question, relevant_chunks, links, cache_key)
+    
+    def _stream_and_cache(self, question: str, relevant_chunks: List[Tuple[DocumentChunk, float]],
+                          links: List[Dict[str, str]], cache_key: Optional[str]) -> Iterator[str]:
+        pieces = []
+        for piece in self._iter_answer(question, relevant_chunks):
+            pieces.append(piece)
+            yield piece
+        if cache_key is not None:
+            self.answer_cache.set(cache_key, ("".join(pieces), list(links)))
 
 # For backward compatibility
 def load_documents() -> List[Dict[str, str]]:
@@ -0,0 +1,116 @@
+import math
+import time
+import logging
+import numpy as np
+import faiss
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Vector index layouts, all searched by inner product over L2-normalized embeddings (cosine similarity)
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw", "sq8")
+DEFAULT_INDEX_TYPE = "flat"
+
+# Below this many vectors IVF/PQ cannot be trained meaningfully and an exact index is used instead
+MIN_TRAINING_VECTORS = 1024
+
+def _nlist(num_vectors: int) -> int:
+    """Number of IVF lists, ~4 sqrt(n) while keeping at least 39 training points per list"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest number of PQ sub-quantizers of at most dimension / 8 that divides the dimension"""
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+def _pq_bits(num_vectors: int) -> int:
+    """Bits per PQ code, 4 (16 centroids) until there are enough vectors to train 256 centroids"""
+    return 8 if num_vectors >= 256 * 39 else 4
+
+def index_description(index_type: str, dimension: int, num_vectors: int) -> str:
+    """faiss.index_factory description for index_type, sized for num_vectors"""
+    if index_type in ("ivf", "ivfpq") and num_vectors < MIN_TRAINING_VECTORS:
+        logger.warning(f"Only {num_vectors} vectors, using an exact index instead of {index_type}")
+        index_type = "flat"
+
+    if index_type == "flat":
+        return "IDMap2,Flat"
+    if index_type == "sq8":
+        return "IDMap2,SQ8"
+    if index_type == "hnsw":
+        return "IDMap2,HNSW32,Flat"
+    if index_type == "ivf":
+        # IVF indexes store their own ids, so they are not wrapped in an IDMap
+        return f"IVF{_nlist(num_vectors)},Flat"
+    if index_type == "ivfpq":
+        return f"IVF{_nlist(num_vectors)},PQ{_pq_subquantizers(dimension)}x{_pq_bits(num_vectors)}"
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+
+def create_index(index_type: str, dimension: int, num_vectors: int = 0) -> faiss.Index:
+    """Create an empty, untrained index of index_type that accepts add_with_ids"""
+    return faiss.index_factory(dimension, index_description(index_type, dimension, num_vectors),
+                               faiss.METRIC_INNER_PRODUCT)
+
+def configure_search(index: faiss.Index, nprobe: int = 16, ef_search: int = 64):
+    """Set the query-time accuracy knobs of approximate indexes"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+
+def supports_remove(index: faiss.Index) -> bool:
+    """Whether vectors can be removed by id, HNSW graphs cannot drop nodes"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(inner, faiss.IndexHNSW)
+
+def build_index(index_type: str, embeddings: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    """Build (and train, if needed) an index of index_type over normalized embeddings"""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    dimension = embeddings.shape[1]
+    index = create_index(index_type, dimension, len(embeddings))
+    if not index.is_trained:
+        index.train(embeddings)
+    if len(embeddings):
+        index.add_with_ids(embeddings, np.ascontiguousarray(ids, dtype='int64'))
+    configure_search(index)
+    return index
+
+def evaluate_recall(index: faiss.Index, embeddings: np.ndarray, ids: np.ndarray,
+                    queries: np.ndarray, k: int = 5) -> Dict[str, float]:
+    """
+    recall@k of index against an exact inner-product search over the same embeddings
+
+    Returns the mean fraction of the exact top k that the index also returns, and the
+    mean query time of both searches in milliseconds.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    k = min(k, len(ids))
+    if not len(queries) or not k:
+        return {"recall": 0.0, "queries": len(queries), "k": k, "index_ms": 0.0, "exact_ms": 0.0}
+
+    exact = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+    exact.add_with_ids(np.ascontiguousarray(embeddings, dtype='float32'), np.ascontiguousarray(ids, dtype='int64'))
+
+    start = time.perf_counter()
+    _, exact_ids = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    _, found_ids = index.search(queries, k)
+    index_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = sum(len(set(expected) & set(found)) for expected, found in zip(exact_ids, found_ids))
+    return {
+        "recall": hits / (len(queries) * k),
+        "queries": len(queries),
+        "k": k,
+        "index_ms": round(index_ms, 3),
+        "exact_ms": round(exact_ms, 3),
+    }
+
+def index_nbytes(index: faiss.Index) -> int:
+    """Serialized size of an index, roughly its memory footprint"""
+    return int(faiss.serialize_index(index).nbytes)
@@ -0,0 +1,184 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items of a streamed task
+_END = object()
+
+class Overloaded(Exception):
+    """Raised when the pool already has as much work in flight as it may queue"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server is busy, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+class WorkerPool:
+    """
+    Bounded thread or process pool for CPU-bound search work
+
+    At most max_workers tasks run at once and at most max_queue more wait for a worker;
+    anything beyond that is rejected with Overloaded instead of piling up. Callers that
+    time out have their work cancelled if it has not started yet.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: int = 64, kind: str = "thread",
+                 retry_after: int = 1):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.kind = kind
+        self.retry_after = retry_after
+        self.rejected = 0
+        self.timed_out = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        if kind == "process":
+            # Forked workers inherit the already built index instead of rebuilding it
+            self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("fork"))
+            # Generators cannot be sent to another process, so streamed tasks run on threads here
+            self._stream_executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="ta-stream")
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="ta-worker")
+            self._stream_executor = self.executor
+        else:
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        logger.info(f"Worker pool: {self.max_workers} {kind} workers, queue of {max_queue}")
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def acquire(self):
+        """
+        Take one unit of capacity for work that reaches the pool some other way (e.g. batching)
+
+        The caller gives it back with release() once that work has really finished.
+        """
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            self._in_flight += 1
+
+    def release(self, *_):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def wait(self, awaitable: Awaitable, timeout: Optional[float] = None) -> Any:
+        """
+        Wait for work that holds capacity taken with acquire(), counting a missed deadline
+
+        Raises:
+            asyncio.TimeoutError: the result was not ready within timeout seconds
+        """
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """
+        Run fn(*args) in the pool
+
+        Raises:
+            Overloaded: the pool is saturated
+            asyncio.TimeoutError: the result was not ready within timeout seconds
+        """
+        self.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.release()
+            raise
+        # Capacity is given back when the work really finishes, not when the caller gives up
+        future.add_done_callback(self.release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            future.cancel()
+            raise
+
+    async def stream(self, fn: Callable, *args, timeout: Optional[float] = None) -> Tuple[Any, AsyncIterator]:
+        """
+        Run fn(*args), which returns (head, iterator), and pass the iterator's items on as they are produced
+
+        The head is returned as soon as fn returns, so a response can start with it while the
+        same worker goes on with the items. Capacity is held until the iterator is exhausted.
+
+        Raises:
+            Overloaded: the pool is saturated
+            asyncio.TimeoutError: fn did not return within timeout seconds
+        """
+        loop = asyncio.get_running_loop()
+        head = loop.create_future()
+        items: asyncio.Queue = asyncio.Queue()
+
+        def produce():
+            value, iterator = fn(*args)
+            loop.call_soon_threadsafe(head.set_result, value)
+            for item in iterator:
+                loop.call_soon_threadsafe(items.put_nowait, item)
+
+        self.acquire()
+        try:
+            future = self._stream_executor.submit(produce)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(items.put_nowait, _END))
+
+        finished = asyncio.wrap_future(future)
+        await asyncio.wait([head, finished], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not head.done():
+            if not finished.done():
+                self.timed_out += 1
+                future.cancel()
+                raise asyncio.TimeoutError()
+            # fn failed before it returned
+            finished.result()
+
+        async def iterate():
+            while True:
+                item = await items.get()
+                if item is _END:
+                    break
+                yield item
+            # Raise what stopped the iterator, if anything
+            await finished
+
+        return head.result(), iterate()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and rejection counters for monitoring"""
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "queue_size": self.max_queue,
+            "in_flight": self._in_flight,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self._stream_executor is not self.executor:
+            self._stream_executor.shutdown(wait=False, cancel_futures=True)
+
+def pool_from_env() -> WorkerPool:
+    """Create a WorkerPool configured by TA_WORKERS, TA_QUEUE_SIZE and TA_POOL"""
+    max_workers = int(os.environ.get("TA_WORKERS", 0)) or None
+    return WorkerPool(
+        max_workers=max_workers,
+        max_queue=int(os.environ.get("TA_QUEUE_SIZE", 64)),
+        kind=os.environ.get("TA_POOL", "thread")
+    )